@@ -0,0 +1,67 @@
+"""Throughput of the doutrina citation parser on a large synthetic corpus.
+
+    python -m benchmarks.bench_citations [entries] [minimum entries/s]
+
+Distinct entries are parsed with the cache cleared, then a corpus where, like in
+the decisions of a crawl, some works are cited many times. Exits with an error when
+distinct entries are parsed slower than the minimum, 20000 entries/s by default.
+"""
+import random
+import string
+import sys
+import time
+
+from stf import citations
+
+CITIES = ["São Paulo", "Rio de Janeiro", "Belo Horizonte", "Porto Alegre", "Coimbra", "Brasília"]
+PUBLISHERS = ["Saraiva", "Malheiros", "Atlas", "Forense", "Revista dos Tribunais", "Livraria do Advogado"]
+
+
+def words(rng: random.Random, count: int):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def author(rng: random.Random):
+    return f"{words(rng, rng.randint(1, 2)).upper()}, {words(rng, rng.randint(1, 3)).title()}"
+
+
+def entry(rng: random.Random):
+    authors = "; ".join(author(rng) for _ in range(rng.choice((1, 1, 1, 2, 3))))
+    parts = [f"{authors}. {words(rng, rng.randint(3, 10)).capitalize()}."]
+    if rng.random() < 0.6:
+        parts.append(f"{rng.randint(1, 40)}{rng.choice(('. ed.', 'ª ed.', 'ª ed. rev. e atual.'))}")
+    parts.append(f"{rng.choice(CITIES)}: {rng.choice(PUBLISHERS)}, {rng.randint(1950, 2022)}.")
+    if rng.random() < 0.7:
+        first = rng.randint(1, 900)
+        parts.append(rng.choice((f"p. {first}.", f"p. {first}-{first + rng.randint(1, 20)}.", f"p. {first} e segs.")))
+    return " ".join(parts)
+
+
+def throughput(entries) -> float:
+    started = time.perf_counter()
+    parsed = citations.parse_batch(entries)
+    elapsed = time.perf_counter() - started
+    assert all(c.year for c in parsed)
+    return len(entries) / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    minimum = float(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = random.Random(0)
+    distinct = [entry(rng) for _ in range(count)]
+    # A long tail of works, the first ones cited by most decisions
+    cited = rng.choices(distinct[: count // 10], [1 / (n + 1) for n in range(count // 10)], k=count)
+
+    citations.parse.cache_clear()
+    cold = throughput(distinct)
+    citations.parse.cache_clear()
+    crawl = throughput(cited)
+    print(f"{count} distinct entries: {cold:,.0f} entries/s")
+    print(f"{count} entries cited like in a crawl: {crawl:,.0f} entries/s")
+    if cold < minimum:
+        sys.exit(f"Parsing distinct entries is below {minimum:,.0f} entries/s")
+
+
+if __name__ == "__main__":
+    main()
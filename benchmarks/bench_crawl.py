@@ -0,0 +1,99 @@
+"""End to end benchmark of JurisSpider against benchmarks.fake_api, offline.
+
+    python -m benchmarks.bench_crawl [--documents 20000] [--latency 0 0.05] [--recorded hits.jl]
+                                     [--max-in-flight 8]
+
+Every pagination mode is crawled once for every latency, each crawl in its own
+process so that its peak RSS and CPU time are its own. With --max-in-flight the API
+answers 429 over that many concurrent requests, counted as throttled.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SCENARIO = """
+import json, resource, sys, time
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from stf.spiders.juris import JurisSpider
+
+url, pagination = sys.argv[1:]
+settings = get_project_settings()
+settings.setdict({
+    "STF_API_URL": url,
+    "HTTPCACHE_ENABLED": False,
+    "STF_CHECKPOINTS": False,
+    "LOG_LEVEL": "WARNING",
+    "TELNETCONSOLE_ENABLED": False,
+})
+process = CrawlerProcess(settings)
+crawler = process.create_crawler(JurisSpider)
+process.crawl(crawler, query="benchmark", pagination=pagination)
+# Imports and setup are left out of the CPU time
+before = resource.getrusage(resource.RUSAGE_SELF)
+started = time.perf_counter()
+process.start()
+elapsed = time.perf_counter() - started
+usage = resource.getrusage(resource.RUSAGE_SELF)
+stats = crawler.stats.get_stats()
+print(json.dumps({
+    "elapsed": elapsed,
+    "cpu": usage.ru_utime + usage.ru_stime - before.ru_utime - before.ru_stime,
+    "rss": usage.ru_maxrss * 1024,
+    "pages": stats.get("response_received_count", 0),
+    "items": stats.get("item_scraped_count", 0),
+    "finish_reason": stats.get("finish_reason"),
+    "throttled": stats.get("aimd/throttled", 0),
+}))
+"""
+
+
+def start_api(args, latency: float):
+    command = [sys.executable, "-m", "benchmarks.fake_api", "--port", "0", "--latency", str(latency)]
+    command += ["--max-in-flight", str(args.max_in_flight)]
+    command += ["--recorded", args.recorded] if args.recorded else ["--documents", str(args.documents)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def crawl(url: str, pagination: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", SCENARIO, url, pagination], capture_output=True, text=True)
+    if out.returncode:
+        sys.exit(out.stderr)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--recorded", help="JSON lines file of recorded hits to serve instead")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0, 0.05])
+    parser.add_argument("--max-in-flight", type=int, default=0, help="concurrent requests the API serves, 0 for all")
+    args = parser.parse_args()
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "stf.settings")
+
+    print(f"{'pagination':<12}{'latency':>9}{'pages':>8}{'items':>9}{'pages/s':>10}{'items/s':>10}{'peak RSS':>11}{'CPU/page':>10}")
+    for latency in args.latency:
+        server, url = start_api(args, latency)
+        try:
+            for pagination in ("offset", "cursor"):
+                r = crawl(url, pagination)
+                pages = max(r["pages"], 1)
+                print(
+                    f"{pagination:<12}{latency * 1000:>7.0f}ms{r['pages']:>8}{r['items']:>9}"
+                    f"{r['pages'] / r['elapsed']:>10.1f}{r['items'] / r['elapsed']:>10.0f}"
+                    f"{r['rss'] / 2 ** 20:>9.0f}MB{r['cpu'] * 1000 / pages:>8.1f}ms"
+                )
+                if r["throttled"]:
+                    print(f"  throttled {r['throttled']} times")
+                if r["finish_reason"] != "finished":
+                    print(f"  finished with {r['finish_reason']}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
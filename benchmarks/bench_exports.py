@@ -0,0 +1,83 @@
+"""Load test of job downloads, comparing the previous in-memory responses with the streamed exports.
+
+    python -m benchmarks.bench_exports [items ...]
+
+Items are generated on the fly, like job.items.iter() fetching them from Scrapinghub,
+and every download is consumed through Flask's test client.
+"""
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+import flask
+
+from stf.exports import FORMATS, export, item_lines
+
+application = flask.Flask(__name__)
+
+
+def words(rng: random.Random, count: int):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def job_items(count: int):
+    rng = random.Random(count)
+    for i in range(count):
+        yield {
+            "kind": "doutrina",
+            "reference": words(rng, 12),
+            "count": rng.randint(1, 50),
+            "decisions": [f"sjur{rng.randint(0, 500000)}" for _ in range(rng.randint(1, 5))],
+        }
+
+
+@application.route("/buffered/<int:count>.<ext>")
+def buffered(count: int, ext):
+    items = job_items(count)
+    if ext == "json":
+        return {"items": [i["lines"] if "lines" in i else i for i in items]}
+    return "\n\n".join(["\n\n".join(item_lines(i)) for i in items]), {"Content-Type": FORMATS[ext]}
+
+
+@application.route("/streamed/<int:count>.<ext>")
+def streamed(count: int, ext):
+    return flask.Response(export(job_items(count), ext), content_type=FORMATS[ext])
+
+
+def download(client, url: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = client.get(url, buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in res.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    res.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_byte, total, size, peak
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    client = application.test_client()
+    for count in counts:
+        print(f"{count} items")
+        for ext in ("json", "txt", "ndjson"):
+            for mode in ("buffered", "streamed"):
+                if mode == "buffered" and ext == "ndjson":
+                    continue
+                first_byte, total, size, peak = download(client, f"/{mode}/{count}.{ext}")
+                print(
+                    f"  {ext:>6} {mode:>8}: {first_byte * 1e3:8.1f} ms first byte {total * 1e3:8.1f} ms total "
+                    f"{size / 1024:9.0f} KiB sent {peak / 1024:9.0f} KiB peak"
+                )
+
+
+if __name__ == "__main__":
+    main()
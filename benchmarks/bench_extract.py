@@ -0,0 +1,131 @@
+"""Compares decoding whole search responses with the streaming extraction used by JurisSpider.
+
+    python -m benchmarks.bench_extract [recorded_response.json ...]
+
+Without arguments it runs on synthetic responses of increasing size. Either way the
+extraction is first checked against json.loads on random nested documents.
+"""
+import json
+import random
+import string
+import sys
+import timeit
+import tracemalloc
+
+from stf import extractors, jsonstream
+from stf.spiders.juris import HITS, PER_PAGE, TOTAL_HITS
+
+HIT_FIELDS = [extractor.path for extractor in extractors.select("doutrina").values()]
+
+
+def words(rng: random.Random, count: int):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def make_response(references: int, extra_fields: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    hits = []
+    for i in range(PER_PAGE):
+        source = {"documental_doutrina_texto": "\n\n".join(words(rng, 12) for _ in range(references))}
+        source.update({f"campo_{j}": words(rng, 30) for j in range(extra_fields)})
+        hits.append({"_index": "acordaos", "_id": f"sjur{i}", "_score": rng.random(), "_source": source})
+    return json.dumps({"result": {"took": 12, "hits": {"total": {"value": 9000}, "hits": hits}}}).encode()
+
+
+def full(body: bytes):
+    result = json.loads(body)["result"]["hits"]
+    total = result["total"]["value"]
+    texts = [hit.get("_source", {}).get("documental_doutrina_texto") for hit in result["hits"]]
+    return total, texts
+
+
+def streaming(body: bytes):
+    total = jsonstream.first(body, TOTAL_HITS)
+    texts = [hit.get("_source", {}).get("documental_doutrina_texto") for hit in jsonstream.iter_items(body, HITS, HIT_FIELDS)]
+    return total, texts
+
+
+def random_value(rng: random.Random, depth: int):
+    kind = rng.randrange(6 if depth else 4)
+    if kind == 0:
+        # Brackets, quotes and escapes inside strings must not be taken for structure
+        return "".join(rng.choices('ab [{]}":,\\é\n', k=rng.randint(0, 8)))
+    if kind == 1:
+        return rng.choice([rng.randint(-1000, 1000), rng.random() * 1e6, 1e-7])
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return rng.choice(["", [], {}])
+    if kind == 4:
+        return [random_value(rng, depth - 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice(["a", "b", "c", "d é", 'e"']): random_value(rng, depth - 1) for _ in range(rng.randint(0, 4))}
+
+
+def locations(value, location=()):
+    yield location
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from locations(child, (*location, key))
+    elif isinstance(value, list):
+        for child in value:
+            yield from locations(child, (*location, "*"))
+
+
+def expected(value, wanted, path=(), location=()):
+    """(path, value) of the wanted locations, in document order, like jsonstream.extract"""
+    if location in wanted:
+        yield path, value
+    elif isinstance(value, dict):
+        for key, child in value.items():
+            yield from expected(child, wanted, (*path, key), (*location, key))
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            yield from expected(child, wanted, (*path, i), (*location, "*"))
+
+
+def check_random(documents: int = 2000, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(documents):
+        document = {"result": random_value(rng, rng.randint(1, 10)), "took": rng.randint(0, 100)}
+        body = json.dumps(document, indent=rng.choice([None, 0, 1, 2]), ensure_ascii=rng.random() < 0.5).encode()
+        assert jsonstream.first(body, ("took",)) == document["took"], body
+        every = sorted(set(locations(document)) - {()}, key=len)
+        wanted = set()
+        for location in rng.sample(every, min(len(every), rng.randint(1, 4))):
+            if not any(location[: len(w)] == w or w[: len(location)] == location for w in wanted):
+                wanted.add(location)
+        assert list(jsonstream.extract(body, wanted)) == list(expected(document, wanted)), (body, wanted)
+    print(f"jsonstream matches json.loads on {documents} random documents")
+
+
+def measure(fn, body: bytes):
+    seconds = min(timeit.repeat(lambda: fn(body), number=5, repeat=3)) / 5
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def report(name: str, body: bytes):
+    assert full(body) == streaming(body)
+    print(f"{name} ({len(body) / 1024:.0f} KiB)")
+    for label, fn in (("res.json()", full), ("jsonstream", streaming)):
+        seconds, peak = measure(fn, body)
+        print(f"  {label:>10}: {seconds * 1e3:8.2f} ms/page {peak / 1024:10.0f} KiB peak")
+
+
+def main():
+    check_random()
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                report(path, f.read())
+        return
+
+    for references, extra_fields in ((2, 0), (10, 0), (10, 10), (10, 40)):
+        report(f"{references} references, {extra_fields} extra fields", make_response(references, extra_fields))
+
+
+if __name__ == "__main__":
+    main()
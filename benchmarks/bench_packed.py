@@ -0,0 +1,81 @@
+"""Size and speed of the packed item format against JSON lines, which local jobs used to be stored in.
+
+    python -m benchmarks.bench_packed [decisions ...]
+
+Two kinds of jobs are generated for every count of decisions: the lines of every
+decision, where the same doctrine is cited again and again, and the deduplicated
+references with the decisions citing them.
+"""
+import gzip
+import io
+import json
+import random
+import string
+import sys
+import time
+
+from stf import packed
+from stf.exports import export
+
+
+def words(rng: random.Random, count: int):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def decisions(count: int):
+    rng = random.Random(count)
+    # Citations follow a long tail, a few works are cited by most decisions
+    works = [f"{words(rng, 2).upper()}. {words(rng, 10).capitalize()}. São Paulo: Editora, 2001." for _ in range(count // 4 + 10)]
+    weights = [1 / (n + 1) for n in range(len(works))]
+    return [
+        {"doutrina": rng.choices(works, weights, k=rng.randint(1, 8)), "julgamento_data": f"20{rng.randint(10, 23)}-01-01"}
+        for _ in range(count)
+    ]
+
+
+def references(count: int):
+    rng = random.Random(count)
+    ids = [f"sjur{rng.randint(1, 500000)}" for _ in range(count)]
+    return [
+        {"kind": "doutrina", "reference": words(rng, 14), "count": n, "decisions": rng.sample(ids, min(n, len(ids)))}
+        for n in (rng.randint(1, 20) for _ in range(count))
+    ]
+
+
+def json_lines(items) -> bytes:
+    return "".join(json.dumps(item) + "\n" for item in items).encode()
+
+
+def read_json_lines(data: bytes):
+    return [json.loads(line) for line in io.BytesIO(data)]
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 50000]
+    print(f"{'job':<24}{'format':<14}{'size':>10}{'write':>9}{'read':>9}{'txt export':>12}")
+    for count in counts:
+        for kind, items in (("decisions", decisions(count)), ("references", references(count))):
+            encoded = {
+                "json lines": (json_lines, read_json_lines),
+                "json lines gz": (lambda i: gzip.compress(json_lines(i)), lambda d: read_json_lines(gzip.decompress(d))),
+                "packed": (lambda i: b"".join(packed.encode(i)), lambda d: list(packed.decode(io.BytesIO(d)))),
+            }
+            for name, (write, read) in encoded.items():
+                data, write_time = timed(write, items)
+                decoded, read_time = timed(read, data)
+                assert decoded == items
+                _, export_time = timed(lambda: sum(map(len, export(read(data), "txt"))))
+                print(
+                    f"{f'{count} {kind}':<24}{name:<14}{len(data) / 2 ** 20:>8.2f}MB"
+                    f"{write_time * 1000:>7.0f}ms{read_time * 1000:>7.0f}ms{export_time * 1000:>10.0f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compares building every page request from make_params against rendering the spider's cached template.
+
+    python -m benchmarks.bench_params
+"""
+import json
+import timeit
+
+from scrapy.http import JsonRequest
+
+from stf.extractors import source_fields
+from stf.spiders.juris import JurisSpider, make_params
+
+QUERY = "dano moral"
+DATE_FROM = "01012000"
+DATE_TO = "31122010"
+PAGES = 66
+
+
+def from_params():
+    for page in range(PAGES):
+        JsonRequest(url=JurisSpider.base_url, data=make_params(QUERY, page, DATE_FROM, DATE_TO))
+
+
+def from_template(spider: JurisSpider):
+    for page in range(PAGES):
+        JsonRequest(url=JurisSpider.base_url, method="POST", body=spider.make_body(QUERY, page, DATE_FROM, DATE_TO))
+
+
+def main():
+    spider = JurisSpider(query=QUERY)
+    source = source_fields(spider.extractors)
+    for page in (0, PAGES - 1):
+        body = json.loads(spider.make_body(QUERY, page, DATE_FROM, DATE_TO))
+        assert body == make_params(QUERY, page, DATE_FROM, DATE_TO, source=source)
+
+    for name, fn in (("make_params", from_params), ("template", lambda: from_template(spider))):
+        best = min(timeit.repeat(fn, number=10, repeat=5)) / (10 * PAGES)
+        print(f"{name:>12}: {best * 1e6:8.1f} µs/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Local stand-in for the STF search API, serving synthetic or recorded acórdãos.
+
+    python -m benchmarks.fake_api [--port 8765] [--documents 20000] [--recorded hits.jl]
+                                  [--latency 0.05] [--jitter 0.02] [--errors 0.01] [--max-in-flight 8]
+
+It honors what JurisSpider sends: `from`/`size`, `search_after`, `_source`, the
+julgamento_data range and `track_total_hits`, and the yearly date histogram of the
+query preview. Every document matches the query and
+scores the same, so hits are ordered by id. Recorded documents are read from a JSON
+lines file of hits or of their `_source`. Latency is injected before every response,
+and --errors answers that share of requests with a 503. Requests arriving while
+--max-in-flight others are being answered get a 429, like a rate limited API.
+
+Point the spider at it with the STF_API_URL setting:
+
+    scrapy crawl juris -a query=x -s STF_API_URL=http://127.0.0.1:8765/api/search/search
+"""
+import argparse
+import json
+import random
+import string
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+TRACK_TOTAL_HITS = 10000
+PATH = "/api/search/search"
+
+
+def words(rng: random.Random, count: int):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def synthetic(count: int, seed: int = 0) -> List[dict]:
+    """Documents with the fields the spider extracts, and some of the large ones it does not"""
+    rng = random.Random(seed)
+    authors = [f"{words(rng, 1).upper()}, {words(rng, 1).title()}" for _ in range(count // 10 + 50)]
+    start = date(1990, 1, 1)
+    docs = []
+    for i in range(count):
+        references = [
+            f"{rng.choice(authors)}. {words(rng, 6).capitalize()}. São Paulo: Editora, {rng.randint(1950, 2020)}."
+            for _ in range(rng.randint(0, 6))
+        ]
+        docs.append(
+            {
+                "_id": f"sjur{i}",
+                "_source": {
+                    "id": f"sjur{i}",
+                    "base": "acordaos",
+                    "titulo": f"RE {rng.randint(1000, 999999)}",
+                    "julgamento_data": (start + timedelta(days=rng.randint(0, 11000))).isoformat(),
+                    "ementa_texto": words(rng, 120),
+                    "decisao_texto": words(rng, 60),
+                    "documental_doutrina_texto": "\n\n".join(references),
+                    "documental_legislacao_citada_texto": "\n\n".join(
+                        f"LEG-FED CF ANO-1988 ART-{rng.randint(1, 250):05d}" for _ in range(rng.randint(0, 4))
+                    ),
+                    "documental_jurisprudencia_citada_texto": "\n\n".join(
+                        f"RE {rng.randint(1000, 999999)}" for _ in range(rng.randint(0, 4))
+                    ),
+                },
+            }
+        )
+    return docs
+
+
+def recorded(path: str) -> List[dict]:
+    docs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            hit = json.loads(line)
+            if "_source" not in hit:
+                hit = {"_id": hit.get("id", str(len(docs))), "_source": hit}
+            docs.append(hit)
+    return docs
+
+
+def find_range(query) -> dict:
+    """The julgamento_data range filter, wherever it is in the query"""
+    if isinstance(query, dict):
+        if "range" in query and "julgamento_data" in query["range"]:
+            return query["range"]["julgamento_data"]
+        values = query.values()
+    elif isinstance(query, list):
+        values = query
+    else:
+        return {}
+    for value in values:
+        found = find_range(value)
+        if found:
+            return found
+    return {}
+
+
+def parse_day(value: Optional[str]) -> Optional[str]:
+    return datetime.strptime(value, "%d%m%Y").date().isoformat() if value else None
+
+
+class SearchIndex:
+    def __init__(self, docs: List[dict]):
+        self.docs = sorted(docs, key=lambda doc: doc["_id"])
+        self.days = [doc["_source"].get("julgamento_data", "")[:10] for doc in self.docs]
+        self.matching = lru_cache(maxsize=256)(self._matching)
+
+    def _matching(self, gte: Optional[str], lte: Optional[str]) -> List[int]:
+        return [i for i, day in enumerate(self.days) if (not gte or day >= gte) and (not lte or day <= lte)]
+
+    def search(self, body: dict) -> dict:
+        date_range = find_range(body.get("query"))
+        matching = self.matching(parse_day(date_range.get("gte")), parse_day(date_range.get("lte")))
+
+        size = body.get("size", 10)
+        if "search_after" in body:
+            after = body["search_after"][-1]
+            start = next((n for n, i in enumerate(matching) if self.docs[i]["_id"] > after), len(matching))
+        else:
+            start = body.get("from", 0)
+
+        source = body.get("_source")
+        hits = []
+        for i in matching[start : start + size]:
+            doc = self.docs[i]
+            fields = doc["_source"] if source is None else {k: v for k, v in doc["_source"].items() if k in source}
+            hits.append({"_index": "acordaos", "_id": doc["_id"], "_score": 1.0, "_source": fields, "sort": [1.0, doc["_id"]]})
+
+        total = len(matching)
+        relation = "eq"
+        if body.get("track_total_hits") is not True and total > TRACK_TOTAL_HITS:
+            total, relation = TRACK_TOTAL_HITS, "gte"
+        result = {"hits": {"total": {"value": total, "relation": relation}, "max_score": 1.0, "hits": hits}}
+        if body.get("aggs"):
+            result["aggregations"] = self.aggregate(body["aggs"], matching)
+        return result
+
+    def aggregate(self, aggs: dict, matching: List[int]) -> dict:
+        """Yearly date histograms of julgamento_data, other aggregations are answered empty"""
+        aggregations = {}
+        for name, agg in aggs.items():
+            histogram = agg.get("date_histogram", {})
+            if histogram.get("field") != "julgamento_data":
+                aggregations[name] = {}
+                continue
+            years = Counter(self.days[i][:4] for i in matching)
+            aggregations[name] = {
+                "buckets": [{"key_as_string": year, "doc_count": count} for year, count in sorted(years.items())]
+            }
+        return aggregations
+
+
+def make_handler(index: SearchIndex, latency: float, jitter: float, errors: float, max_in_flight: int = 0):
+    in_flight = 0
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path.split("#")[0] != PATH:
+                return self.send(404, b"{}")
+
+            nonlocal in_flight
+            with lock:
+                if max_in_flight and in_flight >= max_in_flight:
+                    return self.send(429, b"{}")
+                in_flight += 1
+            try:
+                self.search(request)
+            finally:
+                with lock:
+                    in_flight -= 1
+
+        def search(self, request: dict):
+            started = time.perf_counter()
+            delay = max(latency + random.uniform(-jitter, jitter), 0)
+            if delay:
+                time.sleep(delay)
+            if errors and random.random() < errors:
+                return self.send(503, b"{}")
+
+            result = index.search(request)
+            took = int((time.perf_counter() - started) * 1000)
+            self.send(200, json.dumps({"result": {"took": took, "timed_out": False, **result}}).encode())
+
+    return Handler
+
+
+def serve(
+    docs: List[dict],
+    port: int = 8765,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    errors: float = 0.0,
+    max_in_flight: int = 0,
+):
+    """Starts the server in a background thread, returns it once it is listening"""
+    ThreadingHTTPServer.request_queue_size = 256
+    handler = make_handler(SearchIndex(docs), latency, jitter, errors, max_in_flight)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--documents", type=int, default=20000, help="synthetic documents to serve")
+    parser.add_argument("--recorded", help="JSON lines file of recorded hits to serve instead")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random seconds added to or taken from latency")
+    parser.add_argument("--errors", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="concurrent requests served, the others get a 429")
+    args = parser.parse_args()
+
+    docs = recorded(args.recorded) if args.recorded else synthetic(args.documents)
+    server = serve(docs, args.port, args.latency, args.jitter, args.errors, args.max_in_flight)
+    # Read by bench_crawl to know where it listens
+    print(f"http://127.0.0.1:{server.server_address[1]}{PATH}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
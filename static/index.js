@@ -1,19 +1,27 @@
 ;(() => {
-  const formats = ['json', 'txt']
+  const formats = ['json', 'ndjson', 'txt']
   const jobId = key => key.split('/')[2]
+  // Groups of jobs are keyed group/<token>
+  const isGroup = key => key.startsWith('group/')
+  const entryId = key => (isGroup(key) ? key.split('/')[1] : jobId(key))
+  const exportUrl = (key, format) =>
+    isGroup(key)
+      ? `/groups/${entryId(key)}.${format}`
+      : `/jobs/${entryId(key)}.${format}`
 
-  const createEntry = ({ key, ts }) => {
+  const createEntry = ({ key, ts, jobs, finished_jobs }) => {
     const element = document.createElement('div')
 
     const title = document.createElement('span')
-    const id = jobId(key)
-    title.innerText = `${id} - ${new Date(ts).toLocaleString()}`
+    const id = entryId(key)
+    const progress = jobs ? ` (${finished_jobs}/${jobs} partes)` : ''
+    title.innerText = `${id} - ${new Date(ts).toLocaleString()}${progress}`
     element.appendChild(title)
 
     for (const format of formats) {
       const anchor = document.createElement('a')
       anchor.classList.add('download')
-      anchor.href = `/jobs/${id}.${format}`
+      anchor.href = exportUrl(key, format)
       anchor.innerText = `(${format})`
       element.appendChild(anchor)
     }
@@ -21,38 +29,19 @@
     return element
   }
 
-  const emptyNode = selector => {
-    const oldChild = document.querySelector(selector)
-    const node = oldChild.cloneNode(false)
-    node.classList.toggle('loader', true)
-    window.requestAnimationFrame(() => {
-      oldChild.parentNode.replaceChild(node, oldChild)
-    })
-    return node
-  }
-
-  const fillNode = (data, oldChild) => {
-    const node = oldChild.cloneNode(false)
-    node.classList.toggle('loader', false)
-    if (data.length === 0) {
-      const element = document.createElement('div')
-      element.innerText = 'Nenhum'
-      node.appendChild(element)
-    } else {
-      data.map(createEntry).map(e => node.append(e))
-    }
-    window.requestAnimationFrame(() => {
-      oldChild.parentNode.replaceChild(node, oldChild)
-    })
-    return node
-  }
-
-  const showMessage = text => {
+  const showMessage = (text, links = []) => {
     const oldChild = document.querySelector('.message')
     const node = oldChild.cloneNode(false)
     const content = document.createElement('span')
     content.innerText = text
     node.appendChild(content)
+    for (const link of links) {
+      const anchor = document.createElement('a')
+      anchor.classList.add('download')
+      anchor.href = link.href
+      anchor.innerText = link.text
+      node.appendChild(anchor)
+    }
     window.requestAnimationFrame(() => {
       oldChild.parentNode.replaceChild(node, oldChild)
     })
@@ -61,39 +50,123 @@
   document.addEventListener('DOMContentLoaded', async e => {
     const reloadButton = document.querySelector('.reload')
 
+    // Entries by key, moved between the lists of their states as they change
+    const entries = new Map()
+    const cursors = {}
+    let since = null
+
+    const slot = state => document.querySelector(`.${state} .slot`)
+    const moreButton = state => document.querySelector(`.${state} .more`)
+
+    const upsert = job => {
+      const old = entries.get(job.key)
+      if (old && JSON.stringify(old.job) === JSON.stringify(job)) {
+        return
+      }
+      if (old) {
+        old.element.remove()
+      }
+      const element = createEntry(job)
+      element.dataset.ts = job.ts
+      // Lists are ordered by the time of the latest change, newest first
+      const list = slot(job.state)
+      const next = Array.from(list.children).find(
+        child => Number(child.dataset.ts) < job.ts
+      )
+      list.insertBefore(element, next || null)
+      entries.set(job.key, { job, element })
+    }
+
+    const setCursors = values => {
+      for (const [state, cursor] of Object.entries(values)) {
+        cursors[state] = cursor
+        moreButton(state).hidden = !cursor
+      }
+    }
+
+    const apply = data => {
+      if (data.cursors && data.since !== undefined) {
+        // A first page replaces everything
+        entries.clear()
+        for (const state of Object.keys(data.cursors)) {
+          slot(state).replaceChildren()
+          slot(state).classList.toggle('loader', false)
+        }
+      }
+      data.jobs.forEach(upsert)
+      if (data.cursors) {
+        setCursors(data.cursors)
+      }
+      if (data.since !== undefined) {
+        since = data.since
+      }
+    }
+
     const reload = async () => {
       if (reloadButton.disabled) {
         return
       }
       reloadButton.disabled = true
+      try {
+        const res = await fetch('/jobs/')
+        const data = await res.json()
+        window.requestAnimationFrame(() => apply(data))
+      } finally {
+        reloadButton.disabled = false
+      }
+    }
 
-      window.requestAnimationFrame(async () => {
-        const runningSlot = emptyNode('.running .slot')
-        const pendingSlot = emptyNode('.pending .slot')
-        const finishedSlot = emptyNode('.finished .slot')
+    // Only the jobs changed since the last token are fetched
+    const poll = async () => {
+      if (since === null) {
+        return reload()
+      }
+      const res = await fetch(`/jobs/?since=${since}`)
+      const data = await res.json()
+      if (data.reset) {
+        return reload()
+      }
+      window.requestAnimationFrame(() => apply(data))
+    }
 
-        const res = await fetch('/jobs/')
-        const { running, pending, finished } = await res.json()
-
-        window.requestAnimationFrame(() => {
-          try {
-            fillNode(running, runningSlot)
-            fillNode(pending, pendingSlot)
-            fillNode(finished, finishedSlot)
-          } finally {
-            reloadButton.disabled = false
-          }
-        })
-      })
+    const loadMore = async e => {
+      const { state } = e.currentTarget.dataset
+      const params = new URLSearchParams({ state, cursor: cursors[state] })
+      const res = await fetch(`/jobs/?${params}`)
+      const data = await res.json()
+      window.requestAnimationFrame(() => apply(data))
     }
 
+    document
+      .querySelectorAll('.more')
+      .forEach(button => button.addEventListener('click', loadMore))
+
+    // The server pushes every change of the jobs, polling is only a fallback
     let interval
+    let streaming = Boolean(window.EventSource)
     const resetInterval = () => {
       clearInterval(interval)
-      interval = setInterval(reload, 60e3)
+      if (!streaming) {
+        interval = setInterval(poll, 60e3)
+      }
     }
     resetInterval()
 
+    if (streaming) {
+      const events = new EventSource('/jobs/events')
+      events.addEventListener('message', e => {
+        const data = JSON.parse(e.data)
+        window.requestAnimationFrame(() => apply(data))
+      })
+      // Closed for good when the server has too many streams open
+      events.addEventListener('error', () => {
+        if (events.readyState === EventSource.CLOSED) {
+          streaming = false
+          resetInterval()
+        }
+      })
+    }
+
     reloadButton.addEventListener('click', e => {
       e.preventDefault()
       reload()
@@ -110,10 +183,23 @@
         method,
       })
 
+      // Answered by a finished job, narrowed to the dates asked for
+      if (res.status === 200) {
+        const { key, date_from, date_to } = await res.json()
+        const params = new URLSearchParams({ date_from, date_to })
+        return showMessage(
+          `Resultado já disponível na execução ${entryId(key)}:`,
+          formats.map(format => ({
+            href: `${exportUrl(key, format)}?${params}`,
+            text: `(${format})`,
+          }))
+        )
+      }
+
       if (res.ok) {
         const { key } = await res.json()
-        showMessage(`Execução agendada! Código: ${jobId(key)}`)
-        return reload()
+        showMessage(`Execução agendada! Código: ${entryId(key)}`)
+        return poll()
       }
 
       if (res.status === 425) {
@@ -129,6 +215,62 @@
 
     document.querySelector('.form').addEventListener('submit', submitForm)
 
+    const previewQuery = async e => {
+      const params = new URLSearchParams(new FormData(e.currentTarget.form))
+      const res = await fetch(`/preview?${params}`)
+      if (!res.ok) {
+        return showMessage(await res.text())
+      }
+      const { total, years, pages, duration } = await res.json()
+      const perYear = Object.entries(years)
+        .map(([year, count]) => `${year}: ${count}`)
+        .join(', ')
+      showMessage(
+        `${total} resultados em ${pages} páginas, cerca de ${Math.ceil(duration / 60)} min. ${perYear}`
+      )
+    }
+
+    document.querySelector('.preview').addEventListener('click', previewQuery)
+
+    const createResult = ({ reference, jobs }) => {
+      const element = document.createElement('div')
+      const text = document.createElement('span')
+      text.innerText = reference
+      element.appendChild(text)
+
+      for (const { key, query } of jobs) {
+        const anchor = document.createElement('a')
+        anchor.classList.add('download')
+        anchor.href = `/jobs/${jobId(key)}.txt`
+        anchor.innerText = `(${jobId(key)}: ${query})`
+        element.appendChild(anchor)
+      }
+
+      return element
+    }
+
+    const search = async e => {
+      e.preventDefault()
+      const params = new URLSearchParams(new FormData(e.currentTarget))
+      const res = await fetch(`/search?${params}`)
+      const oldChild = document.querySelector('.results')
+      const node = oldChild.cloneNode(false)
+      if (!res.ok) {
+        node.innerText = `Ocorreu um erro inesperado: ${res.status} ${res.statusText}.`
+      } else {
+        const { results } = await res.json()
+        if (results.length === 0) {
+          node.innerText = 'Nenhum'
+        }
+        results.map(createResult).map(e => node.append(e))
+      }
+      window.requestAnimationFrame(() => {
+        oldChild.parentNode.replaceChild(node, oldChild)
+      })
+    }
+
+    document.querySelector('.search-form').addEventListener('submit', search)
+
     reload()
   })
 })()
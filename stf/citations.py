@@ -0,0 +1,111 @@
+"""Structured citations out of the doutrina entries of decisions.
+
+Entries roughly follow ABNT, like
+
+    MENDES, Gilmar Ferreira; BRANCO, Paulo Gustavo Gonet. Curso de direito constitucional. 7. ed. São Paulo: Saraiva, 2012. p. 123-125.
+
+The pages and the imprint (city: publisher, year) are matched at the end of the
+entry, the edition anywhere, and what is left is split into sentences by a small
+tokenizer aware of initials and abbreviations: the author is the first one when it
+starts with an uppercase surname, the title the rest. Fields that are not found are
+left out, so entries in other styles still get their year and pages.
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional
+
+# Same entries are cited by decision after decision
+CACHE_SIZE = 1 << 16
+
+_pages = re.compile(
+    r"[.,;]?\s*\b(?:p|pp|pág|págs|pag|pags|fls?)\.?\s*"
+    r"(\d+(?:\s*(?:[-–/]|e|a)\s*\d+)*(?:\s*(?:e\s+)?(?:ss|segs?|seguintes)\b\.?)?)\s*\.?$",
+    re.I,
+)
+# Publisher and year after the colon of an imprint
+_imprint = re.compile(r"\s*([^:]+?)\s*[,.]\s*((?:1[5-9]|20)\d\d)\b")
+_city_start = ".,;[]()"
+# Pages are looked for in that many characters at the end
+_pages_tail = 60
+_year = re.compile(r"\b(?:1[5-9]|20)\d\d\b")
+_edition = re.compile(r"\b(\d+)\s*(?:ª|º|°|a\.?|\.)?\s*ed(?:ição|içao|icao|\.|\b)\s*(?:(?:rev|atual|ampl|aum)\w*\.?\s*(?:e\s*)?)*[,.]?", re.I)
+_period = re.compile(r"\.(?:\s+|$)")
+_author = re.compile(r"^[A-ZÀ-Þ][A-ZÀ-Þ'’.\- ]+,\s*\S")
+_abbreviations = frozenset(
+    "ed org orgs coord coords trad rev atual ampl aum v vol t n nº art arts cf jr dr min des prof sr dra "
+    "cap ss segs op cit apud s.l s.n".split()
+)
+
+
+class Citation(NamedTuple):
+    author: Optional[str] = None
+    title: Optional[str] = None
+    edition: Optional[str] = None
+    city: Optional[str] = None
+    publisher: Optional[str] = None
+    year: Optional[str] = None
+    pages: Optional[str] = None
+
+    def asdict(self) -> dict:
+        """Fields found, as an item field"""
+        return {key: value for key, value in zip(self._fields, self) if value}
+
+
+def sentences(text: str) -> List[str]:
+    """Splits on periods, except those of initials and abbreviations"""
+    parts, start = [], 0
+    for match in _period.finditer(text):
+        end = match.start()
+        word = text[text.rfind(" ", start, end) + 1 : end].lstrip("([")
+        if len(word) <= 1 or word.lower() in _abbreviations:
+            continue
+        parts.append(text[start:end].strip())
+        start = match.end()
+    parts.append(text[start:].strip(" ."))
+    return [part for part in parts if part]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse(entry: str) -> Citation:
+    text = " ".join(entry.split()).rstrip(";")
+    fields = {}
+
+    match = _pages.search(text, max(len(text) - _pages_tail, 0))
+    if match:
+        fields["pages"] = match.group(1).rstrip(".")
+        text = text[: match.start()]
+
+    # Scanning from the last colon, since titles may have colons too
+    colon = text.rfind(":")
+    while colon > 0:
+        start = max(text.rfind(c, 0, colon) for c in _city_start) + 1
+        city = text[start:colon].strip()
+        imprint = _imprint.match(text, colon + 1) if city else None
+        if imprint:
+            fields["city"] = city
+            fields["publisher"] = imprint.group(1)
+            fields["year"] = imprint.group(2)
+            text = text[:start]
+            break
+        colon = text.rfind(":", 0, colon)
+    else:
+        years = _year.findall(text)
+        if years:
+            fields["year"] = years[-1]
+
+    match = _edition.search(text)
+    if match:
+        fields["edition"] = match.group(1)
+        text = f"{text[: match.start()]}. {text[match.end():]}"
+
+    parts = sentences(text)
+    if parts and _author.match(parts[0]):
+        fields["author"] = parts.pop(0)
+    if parts:
+        fields["title"] = ". ".join(parts).strip(" ,;")
+    return Citation(**fields)
+
+
+def parse_batch(entries: Iterable[str]) -> List[Citation]:
+    """Citations of many entries, parsing every distinct one once"""
+    return [parse(entry) for entry in entries]
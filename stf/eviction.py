@@ -0,0 +1,24 @@
+"""Least recently used eviction of the SQLite caches, rows having a `size` in bytes and an `accessed` time."""
+import sqlite3
+from typing import Iterator, Sequence, Tuple
+
+# Some room is made at once instead of evicting on every write
+HEADROOM = 0.9
+
+
+def evict(
+    db: sqlite3.Connection, table: str, keys: Sequence[str], total: int, max_bytes: int
+) -> Iterator[Tuple[tuple, int]]:
+    """Deletes the least recently used rows of `table` until `total` is under HEADROOM of max_bytes.
+
+    Yields the key columns and the size of every row deleted, it must be consumed.
+    """
+    target = max_bytes * HEADROOM
+    columns = ", ".join(keys)
+    where = " AND ".join(f"{key} = ?" for key in keys)
+    for *key, size in db.execute(f"SELECT {columns}, size FROM {table} ORDER BY accessed").fetchall():
+        if total <= target:
+            break
+        db.execute(f"DELETE FROM {table} WHERE {where}", key)
+        total -= size
+        yield tuple(key), size
@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from stf import eviction
+
+
+class ExportCache:
+    """Rendered exports of finished jobs, gzipped on disk and indexed in a SQLite database.
+
+    Files are written while the first download is streamed, and the least recently
+    used ones are evicted once they exceed max_bytes. The ETag of an export is the
+    hash of its uncompressed content, kept with its uncompressed length for serving
+    byte ranges of it. Exports are named after their job or group, and date range.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        with closing(self.connect()) as db:
+            db.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS exports (
+                    name TEXT NOT NULL,
+                    ext TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL,
+                    length INTEGER,
+                    PRIMARY KEY (name, ext)
+                );
+                """
+            )
+            # Caches created when exports were only of job ids, and had no length
+            columns = {row[1] for row in db.execute("PRAGMA table_info(exports)")}
+            if "job" in columns:
+                length = "length" if "length" in columns else "NULL"
+                db.executescript(
+                    f"""
+                    BEGIN;
+                    ALTER TABLE exports RENAME TO exports_old;
+                    DROP INDEX IF EXISTS exports_accessed;
+                    CREATE TABLE exports (
+                        name TEXT NOT NULL,
+                        ext TEXT NOT NULL,
+                        etag TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        accessed REAL NOT NULL,
+                        length INTEGER,
+                        PRIMARY KEY (name, ext)
+                    );
+                    INSERT INTO exports SELECT CAST(job AS TEXT), ext, etag, size, accessed, {length} FROM exports_old;
+                    DROP TABLE exports_old;
+                    COMMIT;
+                    """
+                )
+            db.execute("CREATE INDEX IF NOT EXISTS exports_accessed ON exports (accessed)")
+
+    def connect(self):
+        # One connection per call, requests may be served from several threads
+        return sqlite3.connect(os.path.join(self.directory, "exports.sqlite3"), isolation_level=None)
+
+    def path(self, name: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{name}.{ext}.gz")
+
+    def get(self, name: str, ext: str) -> Optional[Tuple[str, str, Optional[int]]]:
+        """Path to the gzipped export, its ETag and its uncompressed length"""
+        with closing(self.connect()) as db:
+            row = db.execute("SELECT etag, length FROM exports WHERE name = ? AND ext = ?", (name, ext)).fetchone()
+            if row is None:
+                return None
+            path = self.path(name, ext)
+            if not os.path.exists(path):
+                db.execute("DELETE FROM exports WHERE name = ? AND ext = ?", (name, ext))
+                return None
+            db.execute("UPDATE exports SET accessed = ? WHERE name = ? AND ext = ?", (time.time(), name, ext))
+        return path, row[0], row[1]
+
+    def write(self, name: str, ext: str, chunks: Iterable[Union[str, bytes]]) -> Iterator[Union[str, bytes]]:
+        """Passes `chunks` through, and caches them once all were consumed"""
+        fd, tmp = tempfile.mkstemp(prefix=f"{name}.{ext}.", suffix=".tmp", dir=self.directory)
+        digest = hashlib.blake2b(digest_size=16)
+        length = 0
+        try:
+            # No timestamp in the header, the same export always compresses to the same bytes
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                for chunk in chunks:
+                    data = chunk if isinstance(chunk, bytes) else chunk.encode()
+                    digest.update(data)
+                    length += len(data)
+                    f.write(data)
+                    yield chunk
+        except BaseException:
+            # Interrupted downloads are not cached
+            os.remove(tmp)
+            raise
+
+        os.replace(tmp, self.path(name, ext))
+        with closing(self.connect()) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO exports (name, ext, etag, size, accessed, length) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, ext, digest.hexdigest(), os.path.getsize(self.path(name, ext)), time.time(), length),
+            )
+            self.evict(db)
+
+    def evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM exports").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for (name, ext), _ in eviction.evict(db, "exports", ["name", "ext"], total, self.max_bytes):
+            try:
+                os.remove(self.path(name, ext))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,23 @@
+from scrapy.exporters import BaseItemExporter
+
+from stf import packed
+
+
+class PackedItemExporter(BaseItemExporter):
+    """Feed exporter of the packed format, registered as "packed" in FEED_EXPORTERS"""
+
+    def __init__(self, file, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.encoder = packed.Encoder()
+
+    def start_exporting(self):
+        self.file.write(packed.MAGIC)
+
+    def export_item(self, item):
+        block = self.encoder.add(dict(self._get_serialized_fields(item)))
+        if block:
+            self.file.write(block)
+
+    def finish_exporting(self):
+        self.file.write(self.encoder.flush())
@@ -0,0 +1,80 @@
+"""Job items rendered as chunks of text, so downloads are streamed while items are fetched."""
+import json
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from stf import packed
+
+# Chunks are buffered up to this size, not to write every item to the socket on its own
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "txt": "text/plain; charset=utf-8",
+    "packed": packed.CONTENT_TYPE,
+}
+
+
+def references(item: dict) -> Iterator[Tuple[str, str, int]]:
+    """(kind, reference, count) of the references of a job item"""
+    # Jobs with deduplicated references output one reference per item
+    if "reference" in item:
+        yield item.get("kind", ""), item["reference"], item.get("count", 1)
+        return
+    # Jobs crawled before the extracted fields were configurable
+    if "lines" in item:
+        for line in item["lines"]:
+            yield "doutrina", line, 1
+        return
+    for kind, value in item.items():
+        if isinstance(value, list) and kind != "queries":
+            for line in value:
+                yield kind, line, 1
+
+
+def item_lines(item) -> List[str]:
+    return [reference for _, reference, _ in references(item)]
+
+
+def buffered(parts: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[str]:
+    buffer, length = [], 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def json_parts(items: Iterable[dict]) -> Iterator[str]:
+    yield '{"items": ['
+    separator = ""
+    for item in items:
+        yield separator
+        yield json.dumps(item["lines"] if "lines" in item else item)
+        separator = ", "
+    yield "]}"
+
+
+def ndjson_parts(items: Iterable[dict]) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(item["lines"] if "lines" in item else item)
+        yield "\n"
+
+
+def txt_parts(items: Iterable[dict]) -> Iterator[str]:
+    separator = ""
+    for item in items:
+        yield separator
+        yield "\n\n".join(item_lines(item))
+        separator = "\n\n"
+
+
+def export(items: Iterable[dict], ext: str) -> Iterator[Union[str, bytes]]:
+    # Packed blocks are binary and large enough already
+    if ext == "packed":
+        return packed.encode(items)
+    parts = {"json": json_parts, "ndjson": ndjson_parts, "txt": txt_parts}[ext]
+    return buffered(parts(items))
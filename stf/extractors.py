@@ -0,0 +1,62 @@
+"""Fields that can be extracted from every hit, selected with the spider's `fields` argument.
+
+Each extractor reads one path of the hit and turns its value into the item field
+named after it. Only the `_source` fields of the selected extractors are requested.
+"""
+import re
+from typing import Any, Callable, Dict, NamedTuple, Tuple
+
+double_nl = re.compile("\r?\n\r?\n")
+
+
+class Extractor(NamedTuple):
+    path: Tuple[str, ...]
+    parse: Callable[[Any], Any]
+
+
+EXTRACTORS: Dict[str, Extractor] = {}
+
+
+def extractor(name: str, *path: str):
+    def register(parse: Callable[[Any], Any]):
+        EXTRACTORS[name] = Extractor(path, parse)
+        return parse
+
+    return register
+
+
+def split_entries(value: str):
+    return [entry.strip() for entry in double_nl.split(value)]
+
+
+def identity(value: Any):
+    return value
+
+
+def parse_day(value: str):
+    """ISO date from either an ISO date or datetime, or dd/mm/yyyy"""
+    if "/" in value:
+        day, month, year = value[:10].split("/")
+        return f"{year}-{month}-{day}"
+    return value[:10]
+
+
+extractor("_id", "_id")(identity)
+extractor("julgamento_data", "_source", "julgamento_data")(parse_day)
+extractor("doutrina", "_source", "documental_doutrina_texto")(split_entries)
+extractor("legislacao_citada", "_source", "documental_legislacao_citada_texto")(split_entries)
+extractor("jurisprudencia_citada", "_source", "documental_jurisprudencia_citada_texto")(split_entries)
+
+
+def select(names: str) -> Dict[str, Extractor]:
+    """Extractors for a comma separated list of names, `_id` is always included"""
+    selected = {"_id": EXTRACTORS["_id"]}
+    for name in filter(None, (name.strip() for name in names.split(","))):
+        if name not in EXTRACTORS:
+            raise ValueError(f"Unknown field {name}, must be one of {', '.join(EXTRACTORS)}")
+        selected[name] = EXTRACTORS[name]
+    return selected
+
+
+def source_fields(extractors: Dict[str, Extractor]):
+    return [extractor.path[1] for extractor in extractors.values() if extractor.path[0] == "_source"]
@@ -0,0 +1,143 @@
+"""Long date ranges crawled as groups of child jobs running in parallel.
+
+A group is split by the hits per year of its preview so that children get about as
+many decisions each. Children are ordinary jobs carrying the token of their group as
+the `group` spider argument, its key being "group/<token>". Their exports are merged
+in date order, with the references found by several children merged into one.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from stf.pipelines import fingerprint
+from stf.preview import prorate
+
+PREFIX = "group"
+
+
+def key(token: str) -> str:
+    return f"{PREFIX}/{token}"
+
+
+def split(years: Dict[str, int], start: date, end: date, parts: int) -> List[Tuple[date, date]]:
+    """Up to `parts` consecutive ranges covering start to end with about as many hits each"""
+    spans = list(prorate(years, start, end))
+    total = sum(hits for _, _, hits in spans)
+    if not total:
+        # Nothing to balance, equal spans of days
+        spans = [(start, end, (end - start).days + 1)]
+        total = spans[0][2]
+
+    bounds, done = [], 0.0
+    for first, last, hits in spans:
+        while len(bounds) < parts - 1 and hits and done + hits >= total * (len(bounds) + 1) / parts:
+            share = (total * (len(bounds) + 1) / parts - done) / hits
+            bounds.append(min(first + timedelta(days=int(share * ((last - first).days + 1))), last))
+        done += hits
+
+    ranges, first = [], start
+    for bound in bounds:
+        # A child ends the day before the next one starts, bounds falling on the same day are merged
+        if bound > first:
+            ranges.append((first, bound - timedelta(days=1)))
+            first = bound
+    ranges.append((first, end))
+    return ranges
+
+
+def combine(token: str, children: List[dict]) -> dict:
+    """Job of a group, summing up its children"""
+    states = {child["state"] for child in children}
+    state = states.pop() if len(states) == 1 else "running"
+    args = [child.get("spider_args", {}) for child in children]
+    job = {
+        "key": key(token),
+        "ts": max(child["ts"] for child in children),
+        "state": state,
+        "spider_args": {
+            "query": args[0].get("query"),
+            "date_from": min(a.get("date_from", "") for a in args),
+            "date_to": max(a.get("date_to", "") for a in args),
+        },
+        "jobs": len(children),
+        "finished_jobs": sum(child["state"] == "finished" for child in children),
+        "items": sum(child.get("items") or 0 for child in children),
+    }
+    if state == "finished":
+        reasons = [child.get("close_reason") for child in children]
+        job["close_reason"] = next((r for r in reasons if r != "finished"), "finished")
+        job["failed_requests"] = sum(child.get("failed_requests") or 0 for child in children)
+    return job
+
+
+def ordered(children: List[dict]) -> List[dict]:
+    return sorted(children, key=lambda child: child.get("spider_args", {}).get("date_from", ""))
+
+
+def collapse(jobs: Iterable[dict], fetch: Callable[[str], List[dict]]) -> List[dict]:
+    """Jobs with the children of every group replaced by the group, where the first of them was"""
+    result, seen = [], set()
+    for job in jobs:
+        token = job.get("spider_args", {}).get("group")
+        if token is None:
+            result.append(job)
+        elif token not in seen:
+            seen.add(token)
+            children = fetch(token)
+            if children:
+                result.append(combine(token, children))
+    return result
+
+
+def merge(streams: Iterable[Iterable[dict]]) -> Iterator[dict]:
+    """Items of the children of a group, in order.
+
+    Decisions are disjoint between children and sent as they come. References are
+    kept in a temporary SQLite database until every child is read, since the same
+    one may be found by all of them, and sent in the order they were first found.
+    """
+    db: Optional[sqlite3.Connection] = None
+    path = None
+    try:
+        for items in streams:
+            for item in items:
+                if "reference" not in item:
+                    yield item
+                    continue
+                if db is None:
+                    fd, path = tempfile.mkstemp(prefix="group-", suffix=".sqlite3")
+                    os.close(fd)
+                    db = sqlite3.connect(path)
+                    db.executescript(
+                        """
+                        PRAGMA journal_mode = OFF;
+                        PRAGMA synchronous = OFF;
+                        CREATE TABLE refs (hash BLOB PRIMARY KEY, item TEXT NOT NULL);
+                        """
+                    )
+                ref = fingerprint(item.get("kind", ""), item["reference"])
+                row = db.execute("SELECT item FROM refs WHERE hash = ?", (ref,)).fetchone()
+                if row is None:
+                    db.execute("INSERT INTO refs VALUES (?, ?)", (ref, json.dumps(item)))
+                    continue
+                merged = json.loads(row[0])
+                merged["count"] = merged.get("count", 1) + item.get("count", 1)
+                merged["decisions"] = merged.get("decisions", []) + item.get("decisions", [])
+                if "dates" in merged and "dates" in item:
+                    merged["dates"] += item["dates"]
+                else:
+                    merged.pop("dates", None)
+                if "queries" in item:
+                    merged["queries"] = list(dict.fromkeys(merged.get("queries", []) + item["queries"]))
+                db.execute("UPDATE refs SET item = ? WHERE hash = ?", (json.dumps(merged), ref))
+
+        if db is not None:
+            for (item,) in db.execute("SELECT item FROM refs ORDER BY rowid"):
+                yield json.loads(item)
+    finally:
+        if db is not None:
+            db.close()
+            os.remove(path)
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from datetime import date, timedelta
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from w3lib.url import urldefrag
+
+from stf import eviction
+from stf.spiders.juris import parse_date
+
+
+def request_key(request) -> bytes:
+    """Search requests differ only in their body, the URL fragment is just a label"""
+    url, _ = urldefrag(request.url)
+    return hashlib.sha256(url.encode() + b"\n" + request.body).digest()
+
+
+class SqliteCacheStorage:
+    """Compressed response cache in a single SQLite database.
+
+    Responses expire after STF_CACHE_TTL seconds, or STF_CACHE_ARCHIVE_TTL when the
+    requested date range ended more than STF_CACHE_ARCHIVE_AGE days ago, since those
+    decisions are not expected to change. The least recently used responses are evicted
+    once the stored bodies exceed STF_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.ttl = settings.getint("STF_CACHE_TTL")
+        self.archive_ttl = settings.getint("STF_CACHE_ARCHIVE_TTL")
+        self.archive_age = timedelta(days=settings.getint("STF_CACHE_ARCHIVE_AGE"))
+        self.max_bytes = settings.getint("STF_CACHE_MAX_BYTES")
+        self.db = None
+        self.size = 0
+
+    def open_spider(self, spider):
+        self.db = sqlite3.connect(os.path.join(self.cachedir, f"{spider.name}.sqlite3"), isolation_level=None)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                key BLOB PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+            """
+        )
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close_spider(self, spider):
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        key = request_key(request)
+        row = self.db.execute(
+            "SELECT url, status, headers, body FROM responses WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        url, status, headers, body = row
+        headers = Headers(headers_raw_to_dict(headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        key = request_key(request)
+        body = zlib.compress(response.body)
+        now = time.time()
+        previous = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                response.url,
+                response.status,
+                headers_dict_to_raw(response.headers),
+                body,
+                len(body),
+                now + self.expiration(request),
+                now,
+            ),
+        )
+        self.size += len(body) - (previous[0] if previous else 0)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def expiration(self, request) -> int:
+        date_to = request.meta.get("date_to")
+        if date_to and parse_date(date_to, date.today()) < date.today() - self.archive_age:
+            return self.archive_ttl
+        return self.ttl
+
+    def evict(self):
+        self.db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        for _, size in eviction.evict(self.db, "responses", ["key"], self.size, self.max_bytes):
+            self.size -= size
@@ -0,0 +1,228 @@
+"""Full text index of the references harvested by finished jobs, in a SQLite FTS5 table.
+
+References are stored once, by the fingerprint of ReferencesPipeline, with the jobs
+citing them. Jobs are indexed as they finish, by a thread of the web app polling the
+backend, along with their normalized query and the days they covered so that they
+can answer later requests (see stf.reuse).
+"""
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Iterable, Iterator, List, Optional
+
+from stf import reuse
+from stf.exports import references
+from stf.pipelines import fingerprint, normalize
+
+_words = re.compile(r"\w+")
+# Columns of the jobs table for reusing them, added to indexes created without them too
+JOB_COLUMNS = {
+    "normalized": "TEXT",
+    "grp": "TEXT",
+    "first_day": "TEXT",
+    "last_day": "TEXT",
+    "dated": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def match_expression(query: str) -> str:
+    """FTS5 query of every word of a user query, the last one as a prefix"""
+    words = _words.findall(query)
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+class ReferenceIndex:
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self.connect()) as db:
+            db.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    query TEXT,
+                    date_from TEXT,
+                    date_to TEXT,
+                    ts INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS refs (
+                    id INTEGER PRIMARY KEY,
+                    hash BLOB NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    reference TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS citations (
+                    ref INTEGER NOT NULL,
+                    job INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (ref, job)
+                ) WITHOUT ROWID;
+                CREATE VIRTUAL TABLE IF NOT EXISTS refs_fts USING fts5(
+                    reference, content = 'refs', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2'
+                );
+                """
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, column in JOB_COLUMNS.items():
+                if name not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_normalized ON jobs (normalized, first_day)")
+
+    def connect(self):
+        # One connection per call, searches are served from several threads
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def since(self) -> int:
+        """Finish time of the latest job indexed, in milliseconds"""
+        with closing(self.connect()) as db:
+            return db.execute("SELECT COALESCE(MAX(ts), 0) FROM jobs").fetchone()[0]
+
+    def add(self, job: dict, items: Iterable[dict]) -> bool:
+        """Indexes a finished job, unless it already was"""
+        job_id = int(job["key"].rsplit("/", 1)[1])
+        args = job.get("spider_args", {})
+        # Jobs run with other arguments, or with items lacking dates, can't answer other requests
+        normalized = reuse.normalize_query(args["query"]) if reuse.reusable(args) else None
+        first, last = reuse.job_days(args, job["ts"]) if normalized else (None, None)
+        dated = True
+
+        def checked(items):
+            nonlocal dated
+            for item in items:
+                dated = dated and reuse.dated(item)
+                yield item
+
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if db.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone():
+                    db.execute("ROLLBACK")
+                    return False
+                db.execute(
+                    "INSERT INTO jobs (id, key, query, date_from, date_to, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, job["key"], args.get("query"), args.get("date_from"), args.get("date_to"), job["ts"]),
+                )
+                for kind, reference, count in (r for item in checked(items) for r in references(item)):
+                    reference = normalize(reference)
+                    if not reference:
+                        continue
+                    key = fingerprint(kind, reference)
+                    row = db.execute("SELECT id FROM refs WHERE hash = ?", (key,)).fetchone()
+                    if row is None:
+                        ref = db.execute(
+                            "INSERT INTO refs (hash, kind, reference) VALUES (?, ?, ?)", (key, kind, reference)
+                        ).lastrowid
+                        db.execute("INSERT INTO refs_fts (rowid, reference) VALUES (?, ?)", (ref, reference))
+                    else:
+                        ref = row[0]
+                    db.execute(
+                        "INSERT INTO citations VALUES (?, ?, ?) ON CONFLICT (ref, job) DO UPDATE SET count = count + ?",
+                        (ref, job_id, count, count),
+                    )
+                db.execute(
+                    "UPDATE jobs SET normalized = ?, grp = ?, first_day = ?, last_day = ?, dated = ? WHERE id = ?",
+                    (normalized, args.get("group"), first, last, dated, job_id),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return True
+
+    def update(self, backend) -> int:
+        """Indexes the jobs finished since the last update, returns how many"""
+        indexed = 0
+        # Oldest first, as the latest job indexed is where the next update starts: when one fails, the
+        # update after it retries from there. Jobs finished in the same millisecond may not be indexed yet
+        for job in reversed(list(backend.finished(self.since()))):
+            if reuse.complete(job):
+                indexed += self.add(job, backend.items(int(job["key"].rsplit("/", 1)[1])))
+        return indexed
+
+    def watch(self, backend, interval: float, logger=None):
+        """Updates the index every `interval` seconds in a daemon thread"""
+
+        def run():
+            while True:
+                try:
+                    self.update(backend)
+                except Exception:
+                    if logger:
+                        logger.exception("Could not update the reference index")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="reference-index", daemon=True).start()
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 50) -> List[dict]:
+        expression = match_expression(query)
+        if not expression:
+            return []
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                """
+                SELECT refs.id, refs.kind, refs.reference
+                FROM refs_fts JOIN refs ON refs.id = refs_fts.rowid
+                WHERE refs_fts MATCH ? AND (? IS NULL OR refs.kind = ?)
+                ORDER BY refs_fts.rank
+                LIMIT ?
+                """,
+                (expression, kind, kind, limit),
+            ).fetchall()
+            results = []
+            for ref, ref_kind, reference in rows:
+                jobs = db.execute(
+                    """
+                    SELECT jobs.key, jobs.query, jobs.date_from, jobs.date_to, citations.count
+                    FROM citations JOIN jobs ON jobs.id = citations.job
+                    WHERE citations.ref = ?
+                    ORDER BY jobs.ts DESC
+                    """,
+                    (ref,),
+                ).fetchall()
+                results.append(
+                    {
+                        "kind": ref_kind,
+                        "reference": reference,
+                        "jobs": [
+                            {"key": key, "query": q, "date_from": date_from, "date_to": date_to, "count": count}
+                            for key, q, date_from, date_to, count in jobs
+                        ],
+                    }
+                )
+        return results
+
+    def covering(self, query: str, first: str, last: str) -> Iterator[dict]:
+        """Jobs, then groups, that covered a range for the same query, latest first.
+
+        Groups are only listed with the children indexed so far, which the caller must
+        check are all of them.
+        """
+        normalized = reuse.normalize_query(query)
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                """
+                SELECT id, key FROM jobs
+                WHERE normalized = ? AND grp IS NULL AND dated AND first_day <= ? AND last_day >= ?
+                ORDER BY ts DESC
+                """,
+                (normalized, first, last),
+            ).fetchall()
+            groups = db.execute(
+                """
+                SELECT grp, COUNT(*) FROM jobs
+                WHERE normalized = ? AND grp IS NOT NULL
+                GROUP BY grp
+                HAVING MIN(dated) AND MIN(first_day) <= ? AND MAX(last_day) >= ?
+                ORDER BY MAX(ts) DESC
+                """,
+                (normalized, first, last),
+            ).fetchall()
+        for job_id, key in rows:
+            yield {"id": job_id, "key": key}
+        for token, count in groups:
+            yield {"group": token, "jobs": count}
@@ -0,0 +1,366 @@
+"""Backends running the juris spider for the web app, selected with the JOB_BACKEND environment variable.
+
+"scrapinghub" (the default) schedules jobs on Scrapinghub, SH_PROJECT holding the
+project id. "local" runs them on this machine, in up to LOCAL_WORKERS processes at
+once, with the queue kept in a SQLite database and the items in packed files (see
+stf.packed) under LOCAL_JOBS_DIR. Local jobs take the STF_* settings found in the
+environment, like STF_API_URL, over those of stf.settings.
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from stf import packed
+
+STATES = ("pending", "running", "finished")
+# Listed jobs have the time of their latest change of state as ts
+META = ["spider_args", "state", "close_reason", "items", "scrapystats", "pending_time", "running_time", "finished_time"]
+STATE_TIMES = {"pending": "pending_time", "running": "running_time", "finished": "finished_time"}
+# Requests the spider gave up on, a job closed as finished with any of them missed items
+FAILED_REQUESTS = "juris/failed_requests"
+
+
+class DuplicateJob(Exception):
+    """A job with the same key is already pending or running"""
+
+
+def job_key(args: dict) -> str:
+    """Key of the job crawling a query and range, at most one per key is pending or running"""
+    return f"{args.get('query')}/{args.get('date_from')}-{args.get('date_to')}"
+
+
+class ScrapinghubBackend:
+    def __init__(self, project_id: int):
+        from scrapinghub import ScrapinghubClient
+
+        self.spider = ScrapinghubClient().get_project(project_id).spiders.get("juris")
+
+    def run(self, job_args: dict, key: str) -> str:
+        from scrapinghub import DuplicateJobError
+
+        try:
+            # Tagged so that the children of a group can be listed
+            tags = [f"group-{job_args['group']}"] if "group" in job_args else None
+            return self.spider.jobs.run(job_args=job_args, meta={"key": key}, add_tag=tags).key
+        except DuplicateJobError as e:
+            raise DuplicateJob(key) from e
+
+    def describe(self, job: dict) -> dict:
+        job = {**job, "ts": job.get(STATE_TIMES[job["state"]]) or 0}
+        stats = job.pop("scrapystats", None) or {}
+        if job["state"] == "finished":
+            job["failed_requests"] = stats.get(FAILED_REQUESTS, 0)
+        return job
+
+    def page(self, state: str, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+        """Jobs in a state, latest first, and the cursor of the next page if there is one"""
+        start = int(cursor or 0)
+        jobs = self.spider.jobs.iter(state=state, start=start, count=limit + 1, meta=META)
+        jobs = [self.describe(job) for job in jobs]
+        return jobs[:limit], str(start + limit) if len(jobs) > limit else None
+
+    def changed(self, since: int) -> Iterator[dict]:
+        """Jobs whose state changed since a timestamp in milliseconds"""
+        for state in STATES:
+            for job in self.spider.jobs.iter(state=state, meta=META):
+                job = self.describe(job)
+                if job["ts"] >= since:
+                    yield job
+                elif state == "finished":
+                    # Finished jobs are listed latest first, the others are few
+                    break
+
+    def finished(self, since: int) -> Iterator[dict]:
+        """Jobs finished since a timestamp in milliseconds, latest first"""
+        meta = ["spider_args", "state", "close_reason", "scrapystats", "finished_time"]
+        for job in self.spider.jobs.iter(state="finished", meta=meta):
+            if job["finished_time"] < since:
+                break
+            yield self.describe(job)
+
+    def active(self, keys: Iterable[str]) -> Set[str]:
+        """Those of `keys` with a pending or running job"""
+        keys = set(keys)
+        return {
+            key
+            for state in ("pending", "running")
+            for job in self.spider.jobs.iter(state=state, meta=["spider_args"])
+            if (key := job_key(job.get("spider_args", {}))) in keys
+        }
+
+    def group(self, token: str) -> List[dict]:
+        """Children of a group, in every state"""
+        return [
+            self.describe(job)
+            for state in STATES
+            for job in self.spider.jobs.iter(state=state, has_tag=f"group-{token}", meta=META)
+        ]
+
+    def state(self, job_id: int) -> Optional[str]:
+        return self.spider.jobs.get(f"{self.spider.key}/{job_id}").metadata.get("state")
+
+    def items(self, job_id: int) -> Iterator[dict]:
+        return self.spider.jobs.get(f"{self.spider.key}/{job_id}").items.iter()
+
+    def packed_path(self, job_id: int) -> Optional[str]:
+        return None
+
+
+class LocalQueue:
+    """Jobs of the local backend, in a SQLite database with their items and logs alongside"""
+
+    prefix = "local/1"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "items"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "logs"), exist_ok=True)
+        with closing(self.connect()) as db:
+            db.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    pid INTEGER,
+                    close_reason TEXT,
+                    items INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+                CREATE INDEX IF NOT EXISTS jobs_state_ts ON jobs (state, ts, id);
+                CREATE INDEX IF NOT EXISTS jobs_ts ON jobs (ts);
+                """
+            )
+            # Added after the first jobs were stored
+            if "failed" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN failed INTEGER")
+
+    def connect(self):
+        db = sqlite3.connect(os.path.join(self.directory, "jobs.sqlite3"), timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def items_path(self, job_id: int) -> str:
+        return os.path.join(self.directory, "items", f"{job_id}.packed")
+
+    def run(self, job_args: dict, key: str) -> str:
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            duplicate = db.execute(
+                "SELECT 1 FROM jobs WHERE key = ? AND state IN ('pending', 'running')", (key,)
+            ).fetchone()
+            if duplicate:
+                db.execute("ROLLBACK")
+                raise DuplicateJob(key)
+            job_id = db.execute(
+                "INSERT INTO jobs (key, args, state, ts) VALUES (?, ?, 'pending', ?)",
+                (key, json.dumps(job_args), time.time()),
+            ).lastrowid
+            db.execute("COMMIT")
+        return f"{self.prefix}/{job_id}"
+
+    def page(self, state: str, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+        # The cursor is the ts and id of the last job of the previous page
+        ts, job_id = (float(value) for value in cursor.split(":")) if cursor else (float("inf"), 0)
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                """
+                SELECT * FROM jobs WHERE state = ? AND (ts < ? OR ts = ? AND id < ?)
+                ORDER BY ts DESC, id DESC LIMIT ?
+                """,
+                (state, ts, ts, job_id, limit + 1),
+            ).fetchall()
+        last = rows[limit - 1] if len(rows) > limit else None
+        return [self.describe(row) for row in rows[:limit]], last and f"{last['ts']!r}:{last['id']}"
+
+    def changed(self, since: int) -> Iterator[dict]:
+        with closing(self.connect()) as db:
+            rows = db.execute("SELECT * FROM jobs WHERE ts >= ? ORDER BY ts", (since / 1000,)).fetchall()
+        return map(self.describe, rows)
+
+    def describe(self, row) -> dict:
+        job = {
+            "key": f"{self.prefix}/{row['id']}",
+            "ts": int(row["ts"] * 1000),
+            "state": row["state"],
+            "spider_args": json.loads(row["args"]),
+        }
+        if row["state"] == "finished":
+            job.update(close_reason=row["close_reason"], items=row["items"], failed_requests=row["failed"] or 0)
+        return job
+
+    def finished(self, since: int) -> Iterator[dict]:
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE state = 'finished' AND ts >= ? ORDER BY ts DESC", (since / 1000,)
+            ).fetchall()
+        return map(self.describe, rows)
+
+    def active(self, keys: Iterable[str]) -> Set[str]:
+        keys = list(keys)
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                f"SELECT key FROM jobs WHERE state IN ('pending', 'running') AND key IN ({', '.join('?' * len(keys))})",
+                keys,
+            ).fetchall()
+        return {row["key"] for row in rows}
+
+    def group(self, token: str) -> List[dict]:
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE json_extract(args, '$.group') = ? ORDER BY id", (token,)
+            ).fetchall()
+        return [self.describe(row) for row in rows]
+
+    def state(self, job_id: int) -> Optional[str]:
+        with closing(self.connect()) as db:
+            row = db.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row and row["state"]
+
+    def items(self, job_id: int) -> Iterator[dict]:
+        try:
+            f = open(self.items_path(job_id), "rb")
+        except FileNotFoundError:
+            yield from self.json_lines(job_id)
+            return
+        # Items of a running job are read up to the last block written
+        with f:
+            yield from packed.decode(f)
+
+    def json_lines(self, job_id: int) -> Iterator[dict]:
+        # Jobs stored before items were packed
+        try:
+            f = open(os.path.join(self.directory, "items", f"{job_id}.jl"), encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+    def packed_path(self, job_id: int) -> Optional[str]:
+        """Items file of a finished job, already in the packed format"""
+        path = self.items_path(job_id)
+        return path if self.state(job_id) == "finished" and os.path.exists(path) else None
+
+    def claim(self, workers: int) -> Optional[int]:
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            running = db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0]
+            row = None
+            if running < workers:
+                row = db.execute("SELECT id FROM jobs WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row:
+                db.execute("UPDATE jobs SET state = 'running', ts = ? WHERE id = ?", (time.time(), row["id"]))
+            db.execute("COMMIT")
+        return row and row["id"]
+
+    def finish(self, job_id: int, close_reason: str, items: Optional[int] = None, failed: int = 0):
+        # Jobs already finished by their own process are left alone. ts is the time of the latest change of state
+        with closing(self.connect()) as db:
+            db.execute(
+                """
+                UPDATE jobs SET state = 'finished', close_reason = ?, items = ?, failed = ?, ts = ?
+                WHERE id = ? AND state = 'running'
+                """,
+                (close_reason, items, failed, time.time(), job_id),
+            )
+
+
+class LocalBackend(LocalQueue):
+    """Local jobs crawled in processes started from a fork server.
+
+    Every web process using the same directory dispatches pending jobs, claiming them
+    in a transaction so that at most `workers` run at once across all of them.
+    """
+
+    def __init__(self, directory: str, workers: int):
+        super().__init__(directory)
+        self.workers = workers
+        # Forked from a clean process with the spider already imported, so a small job starts right away
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["scrapy.crawler", "stf.spiders.juris", "stf.pipelines", "stf.httpcache"])
+        self.wakeup = threading.Event()
+        threading.Thread(target=self.dispatch, name="local-jobs", daemon=True).start()
+
+    def run(self, job_args: dict, key: str) -> str:
+        key = super().run(job_args, key)
+        self.wakeup.set()
+        return key
+
+    def dispatch(self):
+        self.fail_orphans()
+        children = {}
+        while True:
+            self.wakeup.wait(1)
+            self.wakeup.clear()
+            for job_id, process in list(children.items()):
+                if not process.is_alive():
+                    process.join()
+                    del children[job_id]
+                    self.finish(job_id, "failed")
+            while True:
+                job_id = self.claim(self.workers)
+                if job_id is None:
+                    break
+                process = self.context.Process(target=crawl, args=(self.directory, job_id))
+                process.start()
+                children[job_id] = process
+                with closing(self.connect()) as db:
+                    db.execute("UPDATE jobs SET pid = ? WHERE id = ?", (process.pid, job_id))
+
+    def fail_orphans(self):
+        """Jobs left running by processes that died with their parent"""
+        with closing(self.connect()) as db:
+            rows = db.execute("SELECT id, pid FROM jobs WHERE state = 'running'").fetchall()
+        for row in rows:
+            try:
+                os.kill(row["pid"], 0)
+            except (OSError, TypeError):
+                self.finish(row["id"], "failed")
+
+
+def crawl(directory: str, job_id: int):
+    """Runs a local job in the current process, which must not have run a crawl before"""
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.settings import Settings
+
+    from stf.spiders.juris import JurisSpider
+
+    queue = LocalQueue(directory)
+    with closing(queue.connect()) as db:
+        args = json.loads(db.execute("SELECT args FROM jobs WHERE id = ?", (job_id,)).fetchone()["args"])
+
+    settings = Settings()
+    settings.setmodule("stf.settings", priority="project")
+    # The web app is configured through the environment, its STF_API_URL must be the one crawled too
+    for name in list(settings):
+        if name.startswith("STF_") and name in os.environ:
+            settings.set(name, os.environ[name], priority="cmdline")
+    settings.set("FEEDS", {queue.items_path(job_id): {"format": "packed", "overwrite": True}})
+    settings.set("LOG_FILE", os.path.join(directory, "logs", f"{job_id}.log"))
+    process = CrawlerProcess(settings, install_root_handler=True)
+    crawler = process.create_crawler(JurisSpider)
+    process.crawl(crawler, **args)
+    process.start()
+
+    stats = crawler.stats.get_stats() if crawler.stats else {}
+    queue.finish(
+        job_id, stats.get("finish_reason", "failed"), stats.get("item_scraped_count", 0), stats.get(FAILED_REQUESTS, 0)
+    )
+
+
+def from_env():
+    if os.environ.get("JOB_BACKEND", "scrapinghub") == "local":
+        return LocalBackend(
+            os.environ.get("LOCAL_JOBS_DIR", "jobs"), int(os.environ.get("LOCAL_WORKERS", os.cpu_count() or 1))
+        )
+    return ScrapinghubBackend(int(os.environ["SH_PROJECT"]))
@@ -0,0 +1,166 @@
+"""Incremental extraction of a few values from a JSON document.
+
+The document is walked as bytes and only the values at the requested paths are
+decoded, everything else is skipped by scanning for its end, with runs of
+unwanted scalar pairs skipped in a single match. Paths are tuples of object keys,
+with "*" matching any array index.
+
+Decoding a whole page with json.loads is several times faster, so responses are only
+streamed once larger than a threshold (see `lookup`), where peak memory matters more.
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Pattern, Tuple
+
+Path = Tuple[Any, ...]
+
+_string = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Separators are consumed as a prefix, then one of: string, opening bracket, closing bracket or literal.
+# Object keys are consumed beforehand by _key
+_token = re.compile(rb"[ \t\n\r,:]*(?:(" + _string + rb")|([\[{])|([\]}])|([^ \t\n\r,:\]}]+))", re.S)
+_key = re.compile(rb"[ \t\n\r,]*(" + _string + rb")[ \t\n\r]*:", re.S)
+_structure = re.compile(_string + rb"|[\[\]{}]", re.S)
+# Keys with escapes may spell a wanted key differently, so they are never skipped in runs
+_plain_key = rb'"[^"\\]*"'
+_nothing = re.compile(b"")
+_STRING, _OPEN, _CLOSE = 1, 2, 3
+
+
+def _skip(body: bytes, pos: int) -> int:
+    """Position right after the container starting at `pos`"""
+    # Strings are matched whole, so brackets inside them are not counted
+    depth = 0
+    for match in _structure.finditer(body, pos):
+        token = match.group()
+        if token in (b"[", b"{"):
+            depth += 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+            if not depth:
+                return match.end()
+    raise ValueError(f"Unterminated value at {pos}")
+
+
+def _compile_runs(locations: set) -> Dict[Path, Pattern]:
+    """For every object location, a pattern consuming consecutive pairs of unwanted keys and scalar values"""
+    children = {}
+    for location in locations:
+        if location:
+            children.setdefault(location[:-1], set()).add(location[-1])
+
+    runs = {}
+    for location, keys in children.items():
+        quoted = [re.escape(json.dumps(key, ensure_ascii=False).encode()) for key in keys if key != "*"]
+        exclude = rb"(?!(?:" + rb"|".join(quoted) + rb")[ \t\n\r]*:)" if quoted else b""
+        runs[location] = re.compile(
+            rb"(?:[ \t\n\r,]*" + exclude + _plain_key + rb"[ \t\n\r]*:[ \t\n\r]*(?:" + _string + rb'|[^ \t\n\r,\]}\[{"]+))*',
+            re.S,
+        )
+    return runs
+
+
+def extract(body: bytes, paths: Iterable[Path]) -> Iterator[Tuple[Path, Any]]:
+    """Yields (path, value) for every value at one of `paths`, in document order"""
+    wanted = {tuple(path) for path in paths}
+    prefixes = {path[:i] for path in wanted for i in range(len(path))}
+    runs = _compile_runs(wanted | prefixes)
+
+    path = []
+    generic = []
+    # One entry per open container, the skipping pattern for objects and None for arrays
+    frames = []
+    token_match = _token.match
+    key_match = _key.match
+    loads = json.loads
+    pos = 0
+    while True:
+        if frames and frames[-1] is not None:
+            pos = frames[-1].match(body, pos).end()
+            match = key_match(body, pos)
+            if match:
+                key = match.group(1)
+                path[-1] = generic[-1] = loads(key) if b"\\" in key else key[1:-1].decode()
+                pos = match.end()
+
+        match = token_match(body, pos)
+        if not match or not match.lastindex:
+            return
+        kind = match.lastindex
+        start = match.start(kind)
+        pos = match.end()
+
+        if kind == _CLOSE:
+            path.pop()
+            generic.pop()
+            frames.pop()
+            continue
+
+        if frames and frames[-1] is None:
+            path[-1] += 1
+
+        location = tuple(generic)
+        if location in wanted:
+            if kind == _OPEN:
+                pos = _skip(body, start)
+            value = body[start:pos]
+            if kind == _STRING and b"\\" not in value:
+                yield tuple(path), value[1:-1].decode()
+            else:
+                yield tuple(path), loads(value)
+        elif kind == _OPEN:
+            if location in prefixes:
+                array = body[start] == 0x5B  # [
+                path.append(-1 if array else None)
+                generic.append("*" if array else None)
+                frames.append(None if array else runs.get(location, _nothing))
+            else:
+                pos = _skip(body, start)
+
+
+def first(body: bytes, path: Path, default: Any = None) -> Any:
+    """Value at `path`, stopping as soon as it is found"""
+    for _, value in extract(body, [path]):
+        return value
+    return default
+
+
+def iter_items(body: bytes, prefix: Path, fields: Iterable[Path]) -> Iterator[dict]:
+    """Yields every element of the array at `prefix`, with only `fields` filled in"""
+    depth = len(prefix)
+    item, index = None, None
+    for path, value in extract(body, [(*prefix, "*", *field) for field in fields]):
+        if path[depth] != index:
+            if item is not None:
+                yield item
+            item, index = {}, path[depth]
+
+        node = item
+        for key in path[depth + 1 : -1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+
+    if item is not None:
+        yield item
+
+
+def decoded(response, max_bytes: int) -> Any:
+    """Whole JSON body of a Scrapy response of at most `max_bytes`, None for larger ones.
+
+    TextResponse.json() keeps what it decoded, so every callback and middleware looking
+    into the same response shares a single json.loads.
+    """
+    if len(response.body) > max_bytes:
+        return None
+    return response.json() if hasattr(response, "json") else json.loads(response.body)
+
+
+def lookup(response, path: Path, max_bytes: int, default: Any = None) -> Any:
+    """Value at `path` of a response, decoded whole unless larger than `max_bytes`"""
+    document = decoded(response, max_bytes)
+    if document is None:
+        return first(response.body, path, default)
+    for key in path:
+        if not isinstance(document, dict) or key not in document:
+            return default
+        document = document[key]
+    return document
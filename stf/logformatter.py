@@ -0,0 +1,14 @@
+import logging
+
+from scrapy import logformatter
+
+from stf.pipelines import DroppedReferences
+
+
+class LogFormatter(logformatter.LogFormatter):
+    def dropped(self, item, exception, response, spider):
+        entry = super().dropped(item, exception, response, spider)
+        # Every decision is dropped once its references are aggregated, that is not worth a warning
+        if isinstance(exception, DroppedReferences):
+            entry["level"] = logging.DEBUG
+        return entry
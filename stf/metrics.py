@@ -0,0 +1,166 @@
+"""Histograms of crawl and web app performance.
+
+The spider writes its histograms to the Scrapy stats when it closes, the web app
+exposes its own in the Prometheus text format.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Iterator
+from typing import Dict, Iterable, Sequence, Tuple
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MILLISECONDS = tuple(s * 1000 for s in SECONDS)
+BYTES = tuple(2 ** n for n in range(10, 27, 2))
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Count of observed values in each bucket, by the upper bound of the bucket"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.bounds = tuple(sorted(buckets))
+        # The last one counts values above every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def cumulative(self) -> Iterator:
+        """(upper bound, count of values up to it), ending with infinity"""
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        for bound, count in zip((*self.bounds, float("inf")), counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q: float) -> float:
+        """Estimated by linear interpolation within the bucket holding the quantile, like Prometheus"""
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, total in self.cumulative():
+            if total >= rank and total > below:
+                if bound == float("inf"):
+                    return self.max
+                return min(lower + (bound - lower) * (rank - below) / (total - below), self.max)
+            lower, below = bound, total
+        return 0.0
+
+    def stats(self, prefix: str) -> Dict[str, float]:
+        """Summary and buckets, as Scrapy stats under `prefix`"""
+        if not self.count:
+            return {}
+        stats = {f"{prefix}/count": self.count, f"{prefix}/sum": round(self.sum, 6), f"{prefix}/max": self.max}
+        for q in QUANTILES:
+            stats[f"{prefix}/p{int(q * 100)}"] = round(self.quantile(q), 6)
+        for bound, total in self.cumulative():
+            stats[f"{prefix}/le_{format_bound(bound)}"] = total
+        return stats
+
+
+class Family:
+    """Histograms of one metric by label values, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float] = SECONDS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = buckets
+        self.histograms: Dict[Tuple[str, ...], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values) -> Histogram:
+        values = tuple(str(v) for v in values)
+        histogram = self.histograms.get(values)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(values, Histogram(self.buckets))
+        return histogram
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        for values, histogram in histograms:
+            labels = [f'{k}="{escape(v)}"' for k, v in zip(self.label_names, values)]
+            for bound, total in histogram.cumulative():
+                le = f'le="{format_bound(bound)}"'
+                lines.append(f"{self.name}_bucket{{{','.join([*labels, le])}}} {total}")
+            selector = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{selector} {histogram.sum}")
+            lines.append(f"{self.name}_count{selector} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class Instrumented:
+    """Proxy of `target` observing in `family` how long calls to `methods` take, labelled with the method name.
+
+    When a call returns an iterator, the time spent iterating it is included, but not
+    the time spent by its consumer.
+    """
+
+    def __init__(self, target, family: Family, methods: Sequence[str], *labels):
+        self.target = target
+        self.family = family
+        self.methods = set(methods)
+        self.labels = labels
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.target, name)
+        if name not in self.methods:
+            return attr
+        histogram = self.family.labels(*self.labels, name)
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except BaseException:
+                histogram.observe(time.perf_counter() - started)
+                raise
+            if isinstance(result, Iterator):
+                return timed(result, histogram, time.perf_counter() - started)
+            histogram.observe(time.perf_counter() - started)
+            return result
+
+        return call
+
+
+def timed(iterable: Iterable, histogram: Histogram, elapsed: float = 0.0) -> Iterator:
+    """Passes `iterable` through, observing the time spent producing its values once it is exhausted"""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            value = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - started
+        yield value
+    histogram.observe(elapsed)
+
+
+def format_bound(bound: float) -> str:
+    if bound == float("inf"):
+        return "+Inf"
+    return str(int(bound)) if bound == int(bound) else str(bound)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(*families: Family) -> str:
+    return "".join(family.render() for family in families)
@@ -0,0 +1,170 @@
+import random
+import time
+from dataclasses import dataclass
+
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from stf import jsonstream
+from stf.spiders.juris import TOOK, api_latency
+
+
+@dataclass
+class Window:
+    """Congestion state of a download slot"""
+
+    latency: float = 0.0
+    took: float = 0.0
+    min_latency: float = float("inf")
+    min_took: float = float("inf")
+    successes: int = 0
+    # Further congestion signals are ignored until then, they come from requests sent before the decrease
+    recovering_until: float = 0.0
+
+
+class AimdMiddleware:
+    """Additive increase / multiplicative decrease of the concurrency and delay of download slots.
+
+    The search API is congested when the smoothed response latency or its own `took`
+    time grow past STF_AIMD_LATENCY_FACTOR times the best seen, then the slot
+    concurrency is multiplied by STF_AIMD_BACKOFF. When it answers 429 or 5xx the
+    delay is doubled as well, or set to its Retry-After. After every window of
+    successful responses, concurrency grows by one and the delay shrinks by
+    STF_AIMD_DELAY_STEP.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start = settings.getint("STF_AIMD_START_CONCURRENCY")
+        self.min_concurrency = settings.getint("STF_AIMD_MIN_CONCURRENCY")
+        self.max_concurrency = settings.getint("STF_AIMD_MAX_CONCURRENCY")
+        self.backoff = settings.getfloat("STF_AIMD_BACKOFF")
+        self.latency_factor = settings.getfloat("STF_AIMD_LATENCY_FACTOR")
+        self.delay_step = settings.getfloat("STF_AIMD_DELAY_STEP")
+        self.max_delay = settings.getfloat("STF_AIMD_MAX_DELAY")
+        self.stream_min_bytes = settings.getint("STF_STREAM_MIN_BYTES")
+        self.windows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("STF_AIMD_ENABLED"):
+            raise NotConfigured
+        return cls(crawler)
+
+    def get_slot(self, request, spider):
+        # Downloader middlewares run before the downloader assigns requests their slot, it is created here if missing
+        key, slot = self.crawler.engine.downloader._get_slot(request, spider)
+        if key not in self.windows:
+            self.windows[key] = Window()
+            slot.concurrency = self.start
+        return key, slot
+
+    def process_request(self, request, spider):
+        # Applies the start concurrency before the first request of a slot is queued
+        self.get_slot(request, spider)
+
+    def process_response(self, request, response, spider):
+        latency = api_latency(request, response)
+        if latency is None:
+            return response
+        key, slot = self.get_slot(request, spider)
+        window = self.windows[key]
+        throttled = response.status == 429 or response.status >= 500
+        if throttled:
+            self.stats.inc_value("aimd/throttled" if response.status == 429 else "aimd/server_error", spider=spider)
+            congested = True
+        else:
+            window.latency = smooth(window.latency, latency)
+            window.min_latency = min(window.min_latency, window.latency)
+            congested = window.latency > window.min_latency * self.latency_factor
+            took = jsonstream.lookup(response, TOOK, self.stream_min_bytes) if response.status == 200 else None
+            if isinstance(took, (int, float)):
+                window.took = smooth(window.took, took)
+                window.min_took = min(window.min_took, window.took)
+                if window.took > window.min_took * self.latency_factor:
+                    self.stats.inc_value("aimd/slow_backend", spider=spider)
+                    congested = True
+
+        now = time.monotonic()
+        if congested:
+            if now >= window.recovering_until:
+                self.decrease(slot, window, now, spider, response if throttled else None)
+        else:
+            window.successes += 1
+            if window.successes >= slot.concurrency:
+                self.increase(slot, window, spider)
+
+        self.stats.set_value("aimd/concurrency", slot.concurrency, spider=spider)
+        self.stats.set_value("aimd/delay", slot.delay, spider=spider)
+        self.stats.max_value("aimd/max_concurrency", slot.concurrency, spider=spider)
+        return response
+
+    def increase(self, slot, window, spider):
+        window.successes = 0
+        slot.concurrency = min(slot.concurrency + 1, self.max_concurrency)
+        slot.delay = max(slot.delay - self.delay_step, 0.0)
+        self.stats.inc_value("aimd/increase", spider=spider)
+
+    def decrease(self, slot, window, now, spider, throttled):
+        window.successes = 0
+        window.recovering_until = now + max(window.latency, slot.delay)
+        slot.concurrency = max(int(slot.concurrency * self.backoff), self.min_concurrency)
+        self.stats.inc_value("aimd/decrease", spider=spider)
+        # Only refused requests slow down the request rate, slow responses are dealt with by concurrency
+        if throttled is None:
+            return
+        delay = max(slot.delay * 2, self.delay_step)
+        retry_after = throttled.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        slot.delay = min(delay, self.max_delay)
+
+
+class BackoffRetryMiddleware(RetryMiddleware):
+    """RetryMiddleware waiting before every retry.
+
+    The wait is random up to STF_RETRY_BACKOFF_BASE seconds doubled for every previous
+    attempt and at most STF_RETRY_BACKOFF_MAX, so retries of requests that failed
+    together are spread out, or the Retry-After of the response when longer.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.backoff_base = settings.getfloat("STF_RETRY_BACKOFF_BASE")
+        self.backoff_max = settings.getfloat("STF_RETRY_BACKOFF_MAX")
+        self.stats = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = super().from_crawler(crawler)
+        middleware.stats = crawler.stats
+        return middleware
+
+    async def process_response(self, request, response, spider):
+        result = super().process_response(request, response, spider)
+        if isinstance(result, Request):
+            retry_after = response.headers.get("Retry-After")
+            await self.backoff(result, spider, float(retry_after) if retry_after and retry_after.isdigit() else 0.0)
+        return result
+
+    async def process_exception(self, request, exception, spider):
+        result = super().process_exception(request, exception, spider)
+        if isinstance(result, Request):
+            await self.backoff(result, spider)
+        return result
+
+    async def backoff(self, request, spider, minimum: float = 0.0):
+        attempt = request.meta.get("retry_times", 1)
+        delay = max(random.uniform(0, min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)), minimum)
+        self.stats.inc_value("retry/backoff_seconds", delay, spider=spider)
+        await deferLater(reactor, delay, lambda: None)
+
+
+def smooth(average: float, value: float, weight: float = 0.2) -> float:
+    """Exponentially weighted moving average, starting at the first value"""
+    return value if not average else average + (value - average) * weight
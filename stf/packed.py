@@ -0,0 +1,198 @@
+"""Compact binary format of job items.
+
+Strings are interned in a table shared by the whole stream, and items are stored as
+arrays of indexes into it, in zlib compressed blocks. After the b"STFP\\x01" header,
+every block is its compressed length as a little-endian uint32, then:
+
+    flags, strings size, shapes size, indexes count   struct "<BIII"
+    new strings                                        JSON array
+    new shapes                                         JSON array of [[key, kind], ...]
+    indexes                                            little-endian uint32 array
+
+Every item is the index of its shape, the keys and kinds of its fields, followed by
+the indexes of their values: "s" a string, "l" the length of a list of strings then
+their indexes, "i" an int, and "j" any other value as a JSON string. Blocks are
+only written whole, so a stream still being written is read up to its last block.
+
+Packed files are printed as JSON lines with `python -m stf.packed < 1.packed`.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"STFP\x01"
+CONTENT_TYPE = "application/vnd.stf.packed"
+# Items and bytes of strings in a block before it is written
+BLOCK_ITEMS = 4096
+BLOCK_BYTES = 1024 * 1024
+# The string table is reset once that large, so a huge job is not interned in memory whole
+MAX_STRINGS = 1 << 20
+RESET = 1
+# Interning does most of the work, higher levels barely shrink blocks further
+ZLIB_LEVEL = 1
+
+_block = struct.Struct("<BIII")
+_length = struct.Struct("<I")
+_max_int = 1 << 32
+
+
+def _indexes(values: List[int]) -> bytes:
+    indexes = array("I", values)
+    if sys.byteorder == "big":
+        indexes.byteswap()
+    return indexes.tobytes()
+
+
+class Encoder:
+    def __init__(self, block_items: int = BLOCK_ITEMS, block_bytes: int = BLOCK_BYTES):
+        self.block_items = block_items
+        self.block_bytes = block_bytes
+        self.strings: Dict[str, int] = {}
+        self.shapes: Dict[Tuple, int] = {}
+        self.reset = False
+        self.new_strings: List[str] = []
+        self.new_shapes: List[Tuple] = []
+        self.indexes: List[int] = []
+        self.items = 0
+        self.size = 0
+
+    def intern(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+            self.new_strings.append(value)
+            self.size += len(value)
+        return index
+
+    def add(self, item: dict) -> Optional[bytes]:
+        """Encodes an item, returns a block when one is complete"""
+        shape, indexes = [], self.indexes
+        start = len(indexes)
+        indexes.append(0)
+        for key, value in item.items():
+            if type(value) is str:
+                shape.append((key, "s"))
+                indexes.append(self.intern(value))
+            elif type(value) is list and all(type(v) is str for v in value):
+                shape.append((key, "l"))
+                indexes.append(len(value))
+                indexes.extend(self.intern(v) for v in value)
+            elif type(value) is int and 0 <= value < _max_int:
+                shape.append((key, "i"))
+                indexes.append(value)
+            else:
+                shape.append((key, "j"))
+                indexes.append(self.intern(json.dumps(value, ensure_ascii=False)))
+
+        shape = tuple(shape)
+        index = self.shapes.get(shape)
+        if index is None:
+            index = self.shapes[shape] = len(self.shapes)
+            self.new_shapes.append(shape)
+        indexes[start] = index
+
+        self.items += 1
+        if self.items >= self.block_items or self.size >= self.block_bytes:
+            return self.flush()
+        return None
+
+    def flush(self) -> bytes:
+        """The block of the items added since the last one, empty when there are none"""
+        if not self.items:
+            return b""
+        strings = json.dumps(self.new_strings, ensure_ascii=False).encode()
+        shapes = json.dumps(self.new_shapes, ensure_ascii=False).encode()
+        payload = zlib.compress(
+            b"".join(
+                (
+                    _block.pack(RESET if self.reset else 0, len(strings), len(shapes), len(self.indexes)),
+                    strings,
+                    shapes,
+                    _indexes(self.indexes),
+                )
+            ),
+            ZLIB_LEVEL,
+        )
+        self.reset = len(self.strings) >= MAX_STRINGS
+        if self.reset:
+            self.strings.clear()
+            self.shapes.clear()
+        self.new_strings, self.new_shapes, self.indexes = [], [], []
+        self.items = self.size = 0
+        return _length.pack(len(payload)) + payload
+
+
+def encode(items: Iterable[dict]) -> Iterator[bytes]:
+    """Packed stream of `items`, a block at a time"""
+    encoder = Encoder()
+    yield MAGIC
+    for item in items:
+        block = encoder.add(item)
+        if block:
+            yield block
+    block = encoder.flush()
+    if block:
+        yield block
+
+
+def decode(f: BinaryIO) -> Iterator[dict]:
+    """Items of a packed stream, up to its last complete block"""
+    if f.read(len(MAGIC)) != MAGIC:
+        return
+    strings: List[str] = []
+    shapes: List[Tuple] = []
+    while True:
+        header = f.read(_length.size)
+        if len(header) < _length.size:
+            return
+        (length,) = _length.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        payload = zlib.decompress(payload)
+
+        flags, strings_size, shapes_size, count = _block.unpack_from(payload)
+        if flags & RESET:
+            strings.clear()
+            shapes.clear()
+        pos = _block.size
+        strings.extend(json.loads(payload[pos : pos + strings_size]))
+        pos += strings_size
+        shapes.extend(json.loads(payload[pos : pos + shapes_size]))
+        pos += shapes_size
+        indexes = array("I")
+        indexes.frombytes(payload[pos : pos + count * indexes.itemsize])
+        if sys.byteorder == "big":
+            indexes.byteswap()
+        yield from _items(indexes.tolist(), strings, shapes)
+
+
+def _items(indexes: List[int], strings: List[str], shapes: List[Tuple]) -> Iterator[dict]:
+    pos, count = 0, len(indexes)
+    while pos < count:
+        item = {}
+        shape = shapes[indexes[pos]]
+        pos += 1
+        for key, kind in shape:
+            if kind == "s":
+                item[key] = strings[indexes[pos]]
+                pos += 1
+            elif kind == "l":
+                end = pos + 1 + indexes[pos]
+                item[key] = [strings[i] for i in indexes[pos + 1 : end]]
+                pos = end
+            elif kind == "i":
+                item[key] = indexes[pos]
+                pos += 1
+            else:
+                item[key] = json.loads(strings[indexes[pos]])
+                pos += 1
+        yield item
+
+
+if __name__ == "__main__":
+    for item in decode(sys.stdin.buffer):
+        print(json.dumps(item, ensure_ascii=False))
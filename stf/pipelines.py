@@ -0,0 +1,151 @@
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import unicodedata
+
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+
+from stf import citations
+
+# Unique references parsed into citations at once when emitted
+CITATIONS_BATCH = 1000
+
+_spaces = re.compile(r"\s+")
+_space_before_punctuation = re.compile(r"\s+([,.;:)\]])")
+_non_word = re.compile(r"[\W_]+")
+_punctuation = str.maketrans(
+    {
+        "‘": "'",
+        "’": "'",
+        "“": '"',
+        "”": '"',
+        "«": '"',
+        "»": '"',
+        "–": "-",
+        "—": "-",
+        "…": "...",
+    }
+)
+
+
+def normalize(reference: str) -> str:
+    reference = unicodedata.normalize("NFKC", reference).translate(_punctuation)
+    reference = _spaces.sub(" ", reference).strip()
+    return _space_before_punctuation.sub(r"\1", reference)
+
+
+def fingerprint(kind: str, reference: str) -> bytes:
+    """Hash of a normalized reference ignoring case and punctuation"""
+    key = _non_word.sub(" ", reference.casefold()).strip()
+    return hashlib.blake2b(f"{kind}:{key}".encode(), digest_size=16).digest()
+
+
+class DroppedReferences(DropItem):
+    pass
+
+
+class ReferencesPipeline:
+    """Aggregates the references extracted from every decision into unique references.
+
+    Unique references are kept in a temporary SQLite database rather than in memory,
+    and emitted with their occurrence count and citing decisions when the spider closes.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.parse_citations = crawler.settings.getbool("PARSE_CITATIONS")
+        self.db = None
+        self.path = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("DEDUP_REFERENCES"):
+            raise NotConfigured
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        fd, self.path = tempfile.mkstemp(prefix="references-", suffix=".sqlite3")
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE refs (
+                hash BLOB PRIMARY KEY,
+                kind TEXT NOT NULL,
+                reference TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE citations (
+                hash BLOB NOT NULL,
+                decision TEXT NOT NULL,
+                date TEXT NOT NULL,
+                PRIMARY KEY (hash, decision)
+            ) WITHOUT ROWID;
+            CREATE TABLE matches (
+                hash BLOB NOT NULL,
+                query TEXT NOT NULL,
+                PRIMARY KEY (hash, query)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def process_item(self, item, spider):
+        # Every list field holds references of its kind, e.g. doutrina or legislacao_citada,
+        # except for the queries of a batch that matched the decision
+        kinds = [kind for kind, value in item.items() if isinstance(value, list) and kind != "queries"]
+        if not kinds:
+            return item
+
+        for kind in kinds:
+            for line in item[kind]:
+                reference = normalize(line)
+                if not reference:
+                    continue
+                key = fingerprint(kind, reference)
+                self.db.execute(
+                    "INSERT INTO refs (hash, kind, reference) VALUES (?, ?, ?) "
+                    "ON CONFLICT (hash) DO UPDATE SET count = count + 1",
+                    (key, kind, reference),
+                )
+                self.db.execute(
+                    "INSERT OR IGNORE INTO citations VALUES (?, ?, ?)",
+                    (key, item.get("_id"), item.get("julgamento_data", "")),
+                )
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO matches VALUES (?, ?)", [(key, query) for query in item.get("queries", ())]
+                )
+        raise DroppedReferences("References aggregated")
+
+    def close_spider(self, spider):
+        # Items emitted from here still reach the feed exporters, which close later with spider_closed
+        refs = self.db.execute("SELECT hash, kind, reference, count FROM refs ORDER BY rowid")
+        while True:
+            rows = refs.fetchmany(CITATIONS_BATCH)
+            if not rows:
+                break
+            doutrina = [row for row in rows if row[1] == "doutrina"] if self.parse_citations else []
+            parsed = dict(zip((row[0] for row in doutrina), citations.parse_batch(row[2] for row in doutrina)))
+            for key, kind, reference, count in rows:
+                self.emit(spider, key, kind, reference, count, parsed.get(key))
+
+        self.db.close()
+        os.remove(self.path)
+
+    def emit(self, spider, key: bytes, kind: str, reference: str, count: int, citation=None):
+        rows = self.db.execute("SELECT decision, date FROM citations WHERE hash = ?", (key,)).fetchall()
+        item = {"kind": kind, "reference": reference, "count": count, "decisions": [row[0] for row in rows]}
+        # Dates of the decisions, in the same order, so that the item can be narrowed to a date range
+        if any(row[1] for row in rows):
+            item["dates"] = [row[1] for row in rows]
+        queries = [row[0] for row in self.db.execute("SELECT query FROM matches WHERE hash = ?", (key,))]
+        if queries:
+            item["queries"] = queries
+        if citation is not None:
+            item["citation"] = citation.asdict()
+        self.crawler.signals.send_catch_log(signal=signals.item_scraped, item=item, response=None, spider=spider)
+        self.crawler.stats.inc_value("references/unique", spider=spider)
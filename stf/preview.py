@@ -0,0 +1,95 @@
+"""Cost of a query before crawling it: its hits per year, pages and an estimate of the crawl duration.
+
+A single search with `size: 0` is sent, with the query of JurisSpider and a date
+histogram of julgamento_data, and its result is cached for a while per query.
+"""
+import json
+import math
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterator, Tuple
+
+from stf.spiders.juris import (
+    EARLIEST_DATE,
+    MAX_RESULT,
+    PER_PAGE,
+    make_params,
+    parse_date,
+    split_range,
+)
+
+# Previews kept at once, the least recently computed are dropped first
+CACHE_SIZE = 256
+YEARS = {"years": {"date_histogram": {"field": "julgamento_data", "calendar_interval": "year", "format": "yyyy"}}}
+
+
+def make_preview_params(query: str, date_from: str, date_to: str) -> dict:
+    params = make_params(query, 0, date_from, date_to, count=True, source=[])
+    params.update(size=0, aggs=YEARS)
+    del params["from"], params["sort"]
+    return params
+
+
+def prorate(years: Dict[str, int], start: date, end: date) -> Iterator[Tuple[date, date, float]]:
+    """(first, last, hits) of every year of a range, with hits spread evenly within each year"""
+    for year in range(start.year, end.year + 1):
+        first, last = max(start, date(year, 1, 1)), min(end, date(year, 12, 31))
+        days = (date(year, 12, 31) - date(year, 1, 1)).days + 1
+        yield first, last, years.get(str(year), 0) * ((last - first).days + 1) / days
+
+
+def estimate_pages(years: Dict[str, int], start: date, end: date) -> int:
+    """Pages requested by a crawl, splitting the range like JurisSpider"""
+    hits = sum(hits for _, _, hits in prorate(years, start, end))
+    if hits > MAX_RESULT and start < end:
+        return 1 + sum(estimate_pages(years, *shard) for shard in split_range(start, end))
+    return max(math.ceil(min(hits, MAX_RESULT) / PER_PAGE), 1)
+
+
+class Preview:
+    def __init__(self, url: str, ttl: float, pages_per_second: float, timeout: float = 30):
+        self.url = url
+        self.ttl = ttl
+        self.pages_per_second = pages_per_second
+        self.timeout = timeout
+        self.cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, query: str, date_from: str = "", date_to: str = "") -> dict:
+        """Preview of a query, dates being yyyy-mm-dd like in the job form"""
+        key = (query, date_from, date_to)
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        preview = self.fetch(query, date_from, date_to)
+        with self.lock:
+            self.cache[key] = (time.monotonic() + self.ttl, preview)
+            self.cache.move_to_end(key)
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return preview
+
+    def fetch(self, query: str, date_from: str, date_to: str) -> dict:
+        # The spider takes dates as ddmmyyyy
+        date_from = "".join(reversed(date_from.split("-")))
+        date_to = "".join(reversed(date_to.split("-")))
+        params = make_preview_params(query, date_from, date_to)
+        request = urllib.request.Request(
+            self.url, data=json.dumps(params).encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as res:
+            result = json.load(res)["result"]
+
+        total = result["hits"]["total"]["value"]
+        years: Dict[str, int] = {
+            bucket["key_as_string"]: bucket["doc_count"]
+            for bucket in result.get("aggregations", {}).get("years", {}).get("buckets", [])
+            if bucket["doc_count"]
+        }
+        pages = estimate_pages(years, parse_date(date_from, EARLIEST_DATE), parse_date(date_to, date.today()))
+        return {"total": total, "years": years, "pages": pages, "duration": round(pages / self.pages_per_second)}
@@ -0,0 +1,64 @@
+"""Requests answered by finished jobs whose query is the same and whose range covers theirs.
+
+Jobs are looked up in the jobs of the reference index (see stf.index) by their
+normalized query and the days they covered, and their items narrowed to the range
+asked for with the julgamento_data of every decision, dates being yyyy-mm-dd.
+"""
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional, Tuple
+
+from stf.spiders.juris import EARLIEST_DATE
+
+# Spider arguments the web app runs jobs with, jobs with any other are not reused
+ARGS = frozenset(("query", "date_from", "date_to", "group"))
+
+
+def normalize_query(query: str) -> str:
+    # Operators are case sensitive in the search API, so only spaces are normalized
+    return " ".join(query.split())
+
+
+def days(date_from: str, date_to: str, until: Optional[date] = None) -> Tuple[str, str]:
+    """First and last days of a range, open ends being the earliest date and `until` or today"""
+    first = date.fromisoformat(date_from) if date_from else EARLIEST_DATE
+    last = date.fromisoformat(date_to) if date_to else until or date.today()
+    return first.isoformat(), last.isoformat()
+
+
+def job_days(args: dict, ts: int) -> Tuple[str, str]:
+    """Days covered by a finished job, one without an end covering up to when it finished"""
+    return days(args.get("date_from", ""), args.get("date_to", ""), datetime.fromtimestamp(ts / 1000).date())
+
+
+def complete(job: dict) -> bool:
+    """Whether a finished job got every page, a job that gave up on some requests missed their items"""
+    return job.get("close_reason") == "finished" and not job.get("failed_requests")
+
+
+def reusable(args: dict) -> bool:
+    return ARGS.issuperset(args) and bool(args.get("query"))
+
+
+def dated(item: dict) -> bool:
+    """Whether an item can be narrowed to a date range"""
+    return "dates" in item or "julgamento_data" in item
+
+
+def within(items: Iterable[dict], first: str, last: str) -> Iterator[dict]:
+    """Items of decisions judged from `first` to `last`, references keeping only their decisions in range"""
+    for item in items:
+        if "dates" in item:
+            kept = [i for i, day in enumerate(item["dates"]) if first <= day <= last]
+            if not kept:
+                continue
+            if len(kept) < len(item["dates"]):
+                # Occurrences are only known per job, a narrowed reference counts its decisions
+                item = {
+                    **item,
+                    "count": len(kept),
+                    "decisions": [item["decisions"][i] for i in kept],
+                    "dates": [item["dates"][i] for i in kept],
+                }
+            yield item
+        elif first <= item.get("julgamento_data", "") <= last:
+            yield item
@@ -17,8 +17,14 @@ NEWSPIDER_MODULE = "stf.spiders"
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # USER_AGENT = 'stf (+http://www.yourdomain.com)'
 
+# Search API crawled by the juris spider
+STF_API_URL = "https://jurisprudencia.stf.jus.br/api/search/search"
+# Responses larger than this are scanned for the extracted fields instead of decoded whole, to bound memory
+STF_STREAM_MIN_BYTES = 4 * 1024 * 1024
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-# CONCURRENT_REQUESTS = 16
+# The search API concurrency is tuned by AimdMiddleware, up to STF_AIMD_MAX_CONCURRENCY
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See http://scrapy.readthedocs.org/en/latest/topics/settings.html#download-delay
@@ -48,9 +54,28 @@ TELNETCONSOLE_ENABLED = False
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'stf.middlewares.MyCustomDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
+    "stf.middlewares.BackoffRetryMiddleware": 550,
+    # Sees 429 and 5xx responses before they are retried
+    "stf.middlewares.AimdMiddleware": 600,
+}
+
+# Failed requests are retried after a random wait of up to STF_RETRY_BACKOFF_BASE seconds,
+# doubled for every attempt and at most STF_RETRY_BACKOFF_MAX
+RETRY_TIMES = 5
+STF_RETRY_BACKOFF_BASE = 1.0
+STF_RETRY_BACKOFF_MAX = 60.0
+
+# Adaptive concurrency and delay for the search API, see stf.middlewares.AimdMiddleware
+STF_AIMD_ENABLED = True
+STF_AIMD_START_CONCURRENCY = 4
+STF_AIMD_MIN_CONCURRENCY = 1
+STF_AIMD_MAX_CONCURRENCY = 32
+STF_AIMD_BACKOFF = 0.5
+STF_AIMD_LATENCY_FACTOR = 2.0
+STF_AIMD_DELAY_STEP = 0.25
+STF_AIMD_MAX_DELAY = 30.0
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
@@ -60,7 +85,21 @@ TELNETCONSOLE_ENABLED = False
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
-# ITEM_PIPELINES = {}
+ITEM_PIPELINES = {
+    "stf.pipelines.ReferencesPipeline": 300,
+}
+
+# Output unique references with their counts instead of the lines of every decision
+DEDUP_REFERENCES = True
+# Doutrina references also get their author, title, edition, imprint and pages, see stf.citations
+PARSE_CITATIONS = True
+
+LOG_FORMATTER = "stf.logformatter.LogFormatter"
+
+# Compact output format, see stf.packed
+FEED_EXPORTERS = {
+    "packed": "stf.exporters.PackedItemExporter",
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -75,8 +114,22 @@ TELNETCONSOLE_ENABLED = False
 
 # Enable and configure HTTP caching (disabled by default)
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED=True
-# HTTPCACHE_EXPIRATION_SECS=0
-# HTTPCACHE_DIR='httpcache'
-# HTTPCACHE_IGNORE_HTTP_CODES=[]
-# HTTPCACHE_STORAGE='scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_ENABLED = True
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = "stf.httpcache.SqliteCacheStorage"
+
+# Search results for recent ranges can still change, keep them for a day
+STF_CACHE_TTL = 24 * 60 * 60
+# Ranges that ended this many days ago are kept for much longer
+STF_CACHE_ARCHIVE_AGE = 365
+STF_CACHE_ARCHIVE_TTL = 90 * 24 * 60 * 60
+STF_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Where incremental crawls keep their marks and results between runs
+STF_STATE_DIR = "state"
+
+# Completed pages are checkpointed, so an interrupted crawl run again with the same
+# arguments within STF_CHECKPOINT_TTL seconds resumes where it stopped
+STF_CHECKPOINTS = True
+STF_CHECKPOINT_TTL = 7 * 24 * 60 * 60
@@ -1,6 +1,10 @@
 import json
 import math
 import re
+import secrets
+from datetime import date, datetime, timedelta
+from functools import wraps
+from typing import Optional, Sequence
 from urllib.parse import (
     parse_qs,
     quote,
@@ -10,23 +14,245 @@ from urllib.parse import (
     urlunparse,
 )
 
-from scrapy import Spider
-from scrapy.http import JsonRequest, Response
+from scrapy import Spider, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import JsonRequest, Request, Response
 from scrapy.selector import Selector
 
+from stf import extractors, jsonstream, metrics
+from stf.state import StateStore
+
 PER_PAGE = 150
 MAX_RESULT = 10000
+DATE_FORMAT = "%d%m%Y"
+# Lower bound for open-ended ranges that need sharding, the court was founded in 1891
+EARLIEST_DATE = date(1891, 1, 1)
+
+
+# Unique per document, keeps the order stable between pages when scores are tied
+TIEBREAKER = "id"
+PAGINATION_MODES = ("offset", "cursor")
+
+# Paths read from the search response, everything else is skipped without decoding
+TOTAL_HITS = ("result", "hits", "total", "value")
+HITS = ("result", "hits", "hits")
+TOOK = ("result", "took")
+SORT = ("sort",)
+
+# Fields available in _source, only the ones picked by the spider extractors are requested
+DEFAULT_SOURCE = [
+    # "base",
+    # "_id",
+    # "id",
+    # "dg_unique",
+    # "titulo",
+    # "ministro_facet",
+    # "procedencia_geografica_completo",
+    # "procedencia_geografica_pais_sigla",
+    # "procedencia_geografica_uf_sigla",
+    # "procedencia_geografica_uf_extenso",
+    # "processo_codigo_completo",
+    # "processo_classe_processual_unificada_extenso",
+    # "processo_classe_processual_unificada_classe_sigla",
+    # "processo_classe_processual_unificada_incidente_sigla",
+    # "processo_numero",
+    # "julgamento_data",
+    # "publicacao_data",
+    # "is_decisao_presidencia",
+    # "relator_processo_nome",
+    # "presidente_nome",
+    # "relator_decisao_nome",
+    # "acordao_ata",
+    # "decisao_texto",
+    # "partes_lista_texto",
+    # "acompanhamento_processual_url",
+    # "dje_url",
+    # "documental_publicacao_lista_texto",
+    # "documental_decisao_mesmo_sentido_lista_texto",
+    # "documental_decisao_mesmo_sentido_is_secundario",
+    # "documental_legislacao_citada_texto",
+    # "documental_indexacao_texto",
+    # "documental_observacao_texto",
+    "documental_doutrina_texto",
+    # "externo_seq_objeto_incidente",
+    # "dg_atualizado_em",
+    # "informativo_nome",
+    # "informativo_numero",
+    # "informativo_url",
+    # "periodo_inicio_data",
+    # "periodo_fim_data",
+    # "conteudo_texto",
+    # "conteudo_html",
+    # "processo_lista_texto",
+    # "sumula_numero",
+    # "orgao_julgador",
+    # "is_vinculante",
+    # "sumula_texto",
+    # "processo_precedente_texto",
+    # "processo_precedente_html",
+    # "processo_classe_processual_unificada_sigla",
+    # "is_questao_ordem",
+    # "is_repercussao_geral_admissibilidade",
+    # "is_repercussao_geral_merito",
+    # "is_repercussao_geral",
+    # "is_processo_antigo",
+    # "is_colac",
+    # "colac_numero",
+    # "colac_pagina",
+    # "revisor_processo_nome",
+    # "relator_acordao_nome",
+    # "julgamento_is_sessao_virtual",
+    # "republicacao_data",
+    # "ementa_texto",
+    # "inteiro_teor_url",
+    # "documental_acordao_mesmo_sentido_lista_texto",
+    # "documental_acordao_mesmo_sentido_is_secundario",
+    # "documental_jurisprudencia_citada_texto",
+    # "documental_assunto_texto",
+    # "documental_tese_tipo",
+    # "documental_tese_texto",
+    # "documental_tese_tema_texto",
+    # "old_seq_colac",
+    # "old_seq_repercussao_geral",
+    # "old_seq_sjur",
+]
+
+ACORDAOS = {"term": {"base": "acordaos"}}
+
+AGGREGATIONS = {
+    "base_agg": {
+        "filters": {
+            "filters": {
+                "acordaos": {"match": {"base": "acordaos"}},
+                "sumulas": {"match": {"base": "sumulas"}},
+                "decisoes": {"match": {"base": "decisoes"}},
+                "informativos": {"match": {"base": "informativos"}},
+            }
+        }
+    },
+    "is_repercussao_geral_agg": {
+        "filters": {
+            "filters": {
+                "true": {"match": {"is_repercussao_geral": "true"}},
+                "false": {"match": {"is_repercussao_geral": "false"}},
+            }
+        }
+    },
+    "is_repercussao_geral_admissibilidade_agg": {
+        "filters": {
+            "filters": {
+                "true": {"match": {"is_repercussao_geral_admissibilidade": "true"}},
+                "false": {"match": {"is_repercussao_geral_admissibilidade": "false"}},
+            }
+        }
+    },
+    "is_repercussao_geral_merito_agg": {
+        "filters": {
+            "filters": {
+                "true": {"match": {"is_repercussao_geral_merito": "true"}},
+                "false": {"match": {"is_repercussao_geral_merito": "false"}},
+            }
+        }
+    },
+    "is_questao_ordem_agg": {
+        "filters": {
+            "filters": {
+                "true": {"match": {"is_questao_ordem": "true"}},
+                "false": {"match": {"is_questao_ordem": "false"}},
+            }
+        }
+    },
+    "is_colac_agg": {
+        "filters": {
+            "filters": {
+                "true": {"match": {"is_colac": "true"}},
+                "false": {"match": {"is_colac": "false"}},
+            }
+        }
+    },
+    "orgao_julgador_agg": {
+        "aggs": {
+            "orgao_julgador_agg": {
+                "terms": {
+                    "field": "orgao_julgador.keyword",
+                    "size": 200,
+                    "execution_hint": "map",
+                }
+            }
+        },
+        "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
+    },
+    "ministro_facet_agg": {
+        "aggs": {
+            "ministro_facet_agg": {
+                "terms": {
+                    "field": "ministro_facet.keyword",
+                    "size": 200,
+                    "execution_hint": "map",
+                }
+            }
+        },
+        "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
+    },
+    "processo_classe_processual_unificada_classe_sigla_agg": {
+        "aggs": {
+            "processo_classe_processual_unificada_classe_sigla_agg": {
+                "terms": {
+                    "field": "processo_classe_processual_unificada_classe_sigla.keyword",
+                    "size": 200,
+                    "execution_hint": "map",
+                }
+            }
+        },
+        "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
+    },
+    "procedencia_geografica_uf_sigla_agg": {
+        "aggs": {
+            "procedencia_geografica_uf_sigla_agg": {
+                "terms": {
+                    "field": "procedencia_geografica_uf_sigla",
+                    "size": 200,
+                    "execution_hint": "map",
+                }
+            }
+        },
+        "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
+    },
+}
 
 
-def make_params(query: str, page: int, date_from: str, date_to: str):
-    date = {}
+def make_date_range(date_from: str, date_to: str):
+    date = {"format": "ddMMyyyy"}
     if date_from:
         date["gte"] = date_from
     if date_to:
         date["lte"] = date_to
+    return {"julgamento_data": date}
 
+
+def make_window(page: int):
     from_ = page * PER_PAGE
-    size = min(MAX_RESULT - from_, PER_PAGE)
+    return from_, min(MAX_RESULT - from_, PER_PAGE)
+
+
+def make_params(
+    query: str,
+    page: int,
+    date_from: str,
+    date_to: str,
+    count: bool = False,
+    aggs: bool = False,
+    search_after: Optional[list] = None,
+    source: Sequence[str] = DEFAULT_SOURCE,
+):
+    date = make_date_range(date_from, date_to)
+
+    if search_after is None:
+        from_, size = make_window(page)
+        cursor = {}
+    else:
+        from_, size = make_window(0)
+        cursor = {"search_after": search_after}
 
     return {
         "query": {
@@ -93,13 +319,11 @@ def make_params(query: str, page: int, date_from: str, date_to: str):
                                 }
                             },
                             {
-                                "range": {
-                                    "julgamento_data": {
-                                        "format": "ddMMyyyy",
-                                        **date,
-                                    }
-                                }
+                                "range": date
                             },
+                            # Facets need the base filter applied after aggregating, otherwise it can
+                            # be part of the query and skip the other bases altogether
+                            *([] if aggs else [ACORDAOS]),
                         ],
                         "must": [],
                         "should": [
@@ -178,186 +402,13 @@ def make_params(query: str, page: int, date_from: str, date_to: str):
                 },
             }
         },
-        "_source": [
-            # "base",
-            # "_id",
-            # "id",
-            # "dg_unique",
-            # "titulo",
-            # "ministro_facet",
-            # "procedencia_geografica_completo",
-            # "procedencia_geografica_pais_sigla",
-            # "procedencia_geografica_uf_sigla",
-            # "procedencia_geografica_uf_extenso",
-            # "processo_codigo_completo",
-            # "processo_classe_processual_unificada_extenso",
-            # "processo_classe_processual_unificada_classe_sigla",
-            # "processo_classe_processual_unificada_incidente_sigla",
-            # "processo_numero",
-            # "julgamento_data",
-            # "publicacao_data",
-            # "is_decisao_presidencia",
-            # "relator_processo_nome",
-            # "presidente_nome",
-            # "relator_decisao_nome",
-            # "acordao_ata",
-            # "decisao_texto",
-            # "partes_lista_texto",
-            # "acompanhamento_processual_url",
-            # "dje_url",
-            # "documental_publicacao_lista_texto",
-            # "documental_decisao_mesmo_sentido_lista_texto",
-            # "documental_decisao_mesmo_sentido_is_secundario",
-            # "documental_legislacao_citada_texto",
-            # "documental_indexacao_texto",
-            # "documental_observacao_texto",
-            "documental_doutrina_texto",
-            # "externo_seq_objeto_incidente",
-            # "dg_atualizado_em",
-            # "informativo_nome",
-            # "informativo_numero",
-            # "informativo_url",
-            # "periodo_inicio_data",
-            # "periodo_fim_data",
-            # "conteudo_texto",
-            # "conteudo_html",
-            # "processo_lista_texto",
-            # "sumula_numero",
-            # "orgao_julgador",
-            # "is_vinculante",
-            # "sumula_texto",
-            # "processo_precedente_texto",
-            # "processo_precedente_html",
-            # "processo_classe_processual_unificada_sigla",
-            # "is_questao_ordem",
-            # "is_repercussao_geral_admissibilidade",
-            # "is_repercussao_geral_merito",
-            # "is_repercussao_geral",
-            # "is_processo_antigo",
-            # "is_colac",
-            # "colac_numero",
-            # "colac_pagina",
-            # "revisor_processo_nome",
-            # "relator_acordao_nome",
-            # "julgamento_is_sessao_virtual",
-            # "republicacao_data",
-            # "ementa_texto",
-            # "inteiro_teor_url",
-            # "documental_acordao_mesmo_sentido_lista_texto",
-            # "documental_acordao_mesmo_sentido_is_secundario",
-            # "documental_jurisprudencia_citada_texto",
-            # "documental_assunto_texto",
-            # "documental_tese_tipo",
-            # "documental_tese_texto",
-            # "documental_tese_tema_texto",
-            # "old_seq_colac",
-            # "old_seq_repercussao_geral",
-            # "old_seq_sjur",
-        ],
-        "aggs": {
-            "base_agg": {
-                "filters": {
-                    "filters": {
-                        "acordaos": {"match": {"base": "acordaos"}},
-                        "sumulas": {"match": {"base": "sumulas"}},
-                        "decisoes": {"match": {"base": "decisoes"}},
-                        "informativos": {"match": {"base": "informativos"}},
-                    }
-                }
-            },
-            "is_repercussao_geral_agg": {
-                "filters": {
-                    "filters": {
-                        "true": {"match": {"is_repercussao_geral": "true"}},
-                        "false": {"match": {"is_repercussao_geral": "false"}},
-                    }
-                }
-            },
-            "is_repercussao_geral_admissibilidade_agg": {
-                "filters": {
-                    "filters": {
-                        "true": {"match": {"is_repercussao_geral_admissibilidade": "true"}},
-                        "false": {"match": {"is_repercussao_geral_admissibilidade": "false"}},
-                    }
-                }
-            },
-            "is_repercussao_geral_merito_agg": {
-                "filters": {
-                    "filters": {
-                        "true": {"match": {"is_repercussao_geral_merito": "true"}},
-                        "false": {"match": {"is_repercussao_geral_merito": "false"}},
-                    }
-                }
-            },
-            "is_questao_ordem_agg": {
-                "filters": {
-                    "filters": {
-                        "true": {"match": {"is_questao_ordem": "true"}},
-                        "false": {"match": {"is_questao_ordem": "false"}},
-                    }
-                }
-            },
-            "is_colac_agg": {
-                "filters": {
-                    "filters": {
-                        "true": {"match": {"is_colac": "true"}},
-                        "false": {"match": {"is_colac": "false"}},
-                    }
-                }
-            },
-            "orgao_julgador_agg": {
-                "aggs": {
-                    "orgao_julgador_agg": {
-                        "terms": {
-                            "field": "orgao_julgador.keyword",
-                            "size": 200,
-                            "execution_hint": "map",
-                        }
-                    }
-                },
-                "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
-            },
-            "ministro_facet_agg": {
-                "aggs": {
-                    "ministro_facet_agg": {
-                        "terms": {
-                            "field": "ministro_facet.keyword",
-                            "size": 200,
-                            "execution_hint": "map",
-                        }
-                    }
-                },
-                "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
-            },
-            "processo_classe_processual_unificada_classe_sigla_agg": {
-                "aggs": {
-                    "processo_classe_processual_unificada_classe_sigla_agg": {
-                        "terms": {
-                            "field": "processo_classe_processual_unificada_classe_sigla.keyword",
-                            "size": 200,
-                            "execution_hint": "map",
-                        }
-                    }
-                },
-                "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
-            },
-            "procedencia_geografica_uf_sigla_agg": {
-                "aggs": {
-                    "procedencia_geografica_uf_sigla_agg": {
-                        "terms": {
-                            "field": "procedencia_geografica_uf_sigla",
-                            "size": 200,
-                            "execution_hint": "map",
-                        }
-                    }
-                },
-                "filter": {"bool": {"must": [{"term": {"base": "acordaos"}}]}},
-            },
-        },
+        "_source": list(source),
+        **({"aggs": AGGREGATIONS, "post_filter": {"bool": {"must": [ACORDAOS], "should": []}}} if aggs else {}),
         "size": size,
         "from": from_,
-        "post_filter": {"bool": {"must": [{"term": {"base": "acordaos"}}], "should": []}},
-        "sort": [{"_score": "desc"}],
+        "track_total_hits": count,
+        "sort": [{"_score": "desc"}, {TIEBREAKER: "asc"}],
+        **cursor,
         # "highlight": {
         #     "highlight_query": {
         #         "bool": {
@@ -606,10 +657,86 @@ def make_params(query: str, page: int, date_from: str, date_to: str):
     }
 
 
-double_nl = re.compile("\r?\n\r?\n")
+class Slot:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class ParamsTemplate:
+    """Request body from make_params serialized once, rendering only the values that change between requests"""
+
+    def __init__(self, query: str, cursor: bool = False, source: Sequence[str] = DEFAULT_SOURCE):
+        params = make_params(query, 0, "", "", search_after=[] if cursor else None, source=source)
+        # Must follow the filter order in make_params
+        params["query"]["function_score"]["query"]["bool"]["filter"][1]["range"] = Slot("range")
+        params["from"] = Slot("from_")
+        params["size"] = Slot("size")
+        params["track_total_hits"] = Slot("count")
+        if cursor:
+            params["search_after"] = Slot("search_after")
+
+        # A random marker can't clash with anything the user might type in the query
+        marker = secrets.token_hex(8)
+        body = json.dumps(params, separators=(",", ":"), default=lambda slot: f"{marker}:{slot.name}")
+        parts = re.split(f'"{marker}:(\\w+)"', body)
+        self.parts = [part.encode() for part in parts]
+        self.slots = parts[1::2]
+
+    def render(self, **values) -> bytes:
+        parts = self.parts[:]
+        for i, slot in enumerate(self.slots):
+            parts[2 * i + 1] = json.dumps(values[slot], separators=(",", ":")).encode()
+        return b"".join(parts)
+
+
+def get_path(value: dict, path: Sequence[str]):
+    for key in path:
+        value = value.get(key)
+        if value is None:
+            return None
+    return value
+
+
+def parse_date(value: str, default: date) -> date:
+    return datetime.strptime(value, DATE_FORMAT).date() if value else default
+
+
+def format_date(value: date) -> str:
+    return value.strftime(DATE_FORMAT)
+
+
+def split_range(date_from: date, date_to: date):
+    middle = date_from + (date_to - date_from) // 2
+    return (date_from, middle), (middle + timedelta(days=1), date_to)
+
+
 nl = re.compile("\r?\n")
 
 
+def api_latency(request: Request, res: Response) -> Optional[float]:
+    """Download latency of a response of the search API, None for cached ones that say nothing about it"""
+    return None if "cached" in res.flags else request.meta.get("download_latency")
+
+
+def measured(callback):
+    """Observes the response of a search API callback, and the time spent in the callback itself"""
+    name = f"parse_seconds/{callback.__name__}"
+
+    @wraps(callback)
+    def wrapper(self, res: Response, *args, **kwargs):
+        latency = api_latency(res.request, res)
+        if latency is not None:
+            self.metrics["latency_seconds"].observe(latency)
+            took = jsonstream.lookup(res, TOOK, self.stream_min_bytes)
+            if isinstance(took, (int, float)):
+                self.metrics["took_ms"].observe(took)
+        self.metrics["response_bytes"].observe(len(res.body))
+        histogram = self.metrics.setdefault(name, metrics.Histogram(metrics.SECONDS))
+        return metrics.timed(callback(self, res, *args, **kwargs), histogram)
+
+    return wrapper
+
+
 class JurisSpider(Spider):
     name = "juris"
     allowed_domains = ["jurisprudencia.stf.jus.br"]
@@ -617,42 +744,328 @@ class JurisSpider(Spider):
 
     def __init__(
         self,
-        query: str,
+        query: str = "",
         date_from: str = "",
         date_to: str = "",
+        pagination: str = "offset",
+        fields: str = "doutrina",
+        incremental: str = "",
+        queries: str = "",
         *args,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
-        self.query = query
+        if pagination not in PAGINATION_MODES:
+            raise ValueError(f"pagination must be one of {', '.join(PAGINATION_MODES)}")
+
+        # A batch of queries comes one per line
+        self.queries = list(dict.fromkeys(filter(None, (q.strip() for q in [query, *queries.splitlines()]))))
+        if not self.queries:
+            raise ValueError("At least one query is required")
+        self.batch = len(self.queries) > 1
+        self.query = self.queries[0]
+
         self.date_from = "".join(reversed(date_from.split("-")))
         self.date_to = "".join(reversed(date_to.split("-")))
+        self.pagination = pagination
+        self.seen = set()
+        # Documents of a batch by _id, each parsed once and tagged with every query that matched it
+        self.documents = {}
+        self.emitted = False
+
+        self.failed = 0
+        # Written to the stats as juris/metrics/<name>/... when the spider closes
+        self.metrics = {
+            "latency_seconds": metrics.Histogram(metrics.SECONDS),
+            "took_ms": metrics.Histogram(metrics.MILLISECONDS),
+            "response_bytes": metrics.Histogram(metrics.BYTES),
+            "hits": metrics.Histogram((0, 1, 10, 50, 100, PER_PAGE)),
+        }
+        self.state = None
+        self.checkpoints = False
+        self.checkpointed = set()
+
+        self.incremental = bool(incremental)
+        if self.incremental and self.batch:
+            raise ValueError("Incremental crawls take a single query")
+        # Only the fields asked for make a decision worth emitting. The date of every decision is
+        # extracted anyway, for the mark of incremental crawls and to filter finished jobs by date
+        self.fields = set(extractors.select(fields)) - {"_id"}
+        self.extractors = extractors.select(f"{fields},julgamento_data")
+        if self.incremental:
+            self.state_key = json.dumps([self.query, self.date_from, self.date_to, sorted(self.extractors)])
+            self.mark = None
+        self.run_key = json.dumps(
+            [self.queries, self.date_from, self.date_to, sorted(self.extractors), pagination, self.incremental]
+        )
+        self.hit_fields = [SORT, *(extractor.path for extractor in self.extractors.values())]
+
+        source = extractors.source_fields(self.extractors)
+        self.templates = {q: ParamsTemplate(q, source=source) for q in self.queries}
+        if pagination == "cursor":
+            self.cursor_templates = {q: ParamsTemplate(q, cursor=True, source=source) for q in self.queries}
+
+    def make_body(
+        self,
+        query: str,
+        page: int,
+        date_from: str,
+        date_to: str,
+        count: bool = False,
+        search_after: Optional[list] = None,
+    ) -> bytes:
+        date_range = make_date_range(date_from, date_to)
+        if search_after is None:
+            from_, size = make_window(page)
+            return self.templates[query].render(range=date_range, count=count, from_=from_, size=size)
+
+        from_, size = make_window(0)
+        return self.cursor_templates[query].render(
+            range=date_range, count=count, from_=from_, size=size, search_after=search_after
+        )
 
-    def make_params(self, page: int):
-        return make_params(self.query, page, self.date_from, self.date_to)
+    def make_url(self, query: str, date_from: str, date_to: str, **extra) -> str:
+        # The fragment only labels requests in the logs, it is never sent
+        fragment = {"q": self.queries.index(query), "from": date_from, "to": date_to, **extra}
+        return f"{self.base_url}#{urlencode(fragment)}"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # Overridden to crawl a stand-in of the API, like benchmarks.fake_api
+        spider.base_url = crawler.settings.get("STF_API_URL", cls.base_url)
+        spider.allowed_domains = [urlparse(spider.base_url).hostname]
+        spider.stream_min_bytes = crawler.settings.getint("STF_STREAM_MIN_BYTES")
+        spider.checkpoints = crawler.settings.getbool("STF_CHECKPOINTS")
+        if spider.incremental or spider.checkpoints:
+            spider.state = StateStore.from_settings(crawler.settings, spider.name)
+        if spider.checkpoints:
+            # Pages completed by an interrupted run of the same crawl are not downloaded again
+            spider.checkpointed = spider.state.checkpointed(spider.run_key, crawler.settings.getint("STF_CHECKPOINT_TTL"))
+            if spider.checkpointed:
+                spider.logger.info("Resuming from %d checkpoints", len(spider.checkpointed))
+        if spider.batch:
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
 
     def start_requests(self):
-        def parse_start_url(res: Response):
-            total_hits = res.json().get("result", {}).get("hits", {}).get("total", {}).get("value")
-            for i in range(0, math.ceil(total_hits / PER_PAGE)):
-                yield JsonRequest(url=f"{self.base_url}#page={i}", data=self.make_params(i), errback=self.error)
-
-        yield JsonRequest(
-            url=self.base_url,
-            callback=parse_start_url,
-            data={
-                **self.make_params(0),
-                # "track_total_hits": "true"
-            },
+        if not self.incremental:
+            for query in self.queries:
+                yield self.make_request(query, self.date_from, self.date_to)
+            return
+
+        date_from = self.date_from
+        mark = self.state.get_mark(self.state_key)
+        if mark:
+            # Decisions judged on the mark date may still be coming, only the ones already seen are skipped
+            mark_date, ids = mark
+            self.mark = mark_date, set(ids)
+            self.seen.update(ids)
+            date_from = format_date(max(mark_date, parse_date(date_from, mark_date)))
+            self.logger.info("Crawling %s from %s", self.query, mark_date)
+        yield self.make_request(self.query, date_from, self.date_to, replay=bool(mark))
+
+    def make_request(
+        self,
+        query: str,
+        date_from: str,
+        date_to: str,
+        page: int = 0,
+        search_after: Optional[list] = None,
+        replay: bool = False,
+    ):
+        """Request of a shard when neither `page` nor `search_after` are given, which also carries its first page"""
+        if page:
+            url = self.make_url(query, date_from, date_to, page=page)
+            callback, cb_kwargs = self.parse, {"query": query}
+        elif search_after is not None:
+            url = self.make_url(query, date_from, date_to, after=json.dumps(search_after))
+            callback, cb_kwargs = self.parse_cursor, {"query": query, "date_from": date_from, "date_to": date_to}
+        else:
+            url = self.make_url(query, date_from, date_to)
+            callback = self.parse_start_url
+            cb_kwargs = {"query": query, "date_from": date_from, "date_to": date_to, "replay": replay}
+
+        if url in self.checkpointed:
+            return Request("data:,", callback=self.resume, cb_kwargs={"url": url, "replay": replay}, dont_filter=True)
+        return JsonRequest(
+            url=url,
+            callback=callback,
+            cb_kwargs=cb_kwargs,
+            meta={"date_to": date_to},
+            method="POST",
+            body=self.make_body(
+                query, page, date_from, date_to, count=not page and search_after is None, search_after=search_after
+            ),
+            errback=self.error,
         )
 
-    def error(self, err):
-        breakpoint()
+    @measured
+    def parse_start_url(self, res: Response, query: str, date_from: str, date_to: str, replay: bool = False):
+        if replay:
+            # Results of previous incremental runs are merged with the new ones
+            yield from self.replay()
+
+        total_hits = jsonstream.lookup(res, TOTAL_HITS, self.stream_min_bytes, 0)
+        if total_hits > MAX_RESULT:
+            start = parse_date(date_from, EARLIEST_DATE)
+            end = parse_date(date_to, date.today())
+            if start < end:
+                shards = [
+                    {"query": query, "date_from": format_date(shard_from), "date_to": format_date(shard_to)}
+                    for shard_from, shard_to in split_range(start, end)
+                ]
+                yield from self.complete(res, query, [], shards)
+                return
+            if self.pagination == "offset":
+                self.logger.warning("%d hits on %s, only the first %d will be crawled", total_hits, date_from, MAX_RESULT)
+
+        # The shard request already carries the first page
+        hits = self.get_hits(res)
+        if self.pagination == "cursor":
+            yield from self.complete(res, query, hits, self.next_cursor(hits, query, date_from, date_to))
+            return
+
+        pages = [
+            {"query": query, "date_from": date_from, "date_to": date_to, "page": i}
+            for i in range(1, math.ceil(min(total_hits, MAX_RESULT) / PER_PAGE))
+        ]
+        yield from self.complete(res, query, hits, pages)
+
+    @measured
+    def parse_cursor(self, res: Response, query: str, date_from: str, date_to: str):
+        hits = self.get_hits(res)
+        yield from self.complete(res, query, hits, self.next_cursor(hits, query, date_from, date_to))
+
+    def next_cursor(self, hits, query: str, date_from: str, date_to: str):
+        if len(hits) < PER_PAGE:
+            return []
+        return [{"query": query, "date_from": date_from, "date_to": date_to, "search_after": hits[-1]["sort"]}]
 
-    def parse(self, res):
-        hits = res.json().get("result", {}).get("hits", {}).get("hits", [])
+    def complete(self, res: Response, query: str, hits, requests):
+        """Checkpoints a page with the requests that follow it, then parses it"""
+        if self.checkpoints:
+            self.state.save_checkpoint(self.run_key, res.request.url, {"query": query, "hits": hits, "requests": requests})
+        yield from self.follow(query, hits, requests)
+
+    def resume(self, res, url: str, replay: bool = False):
+        if replay:
+            yield from self.replay()
+        checkpoint = self.state.get_checkpoint(self.run_key, url)
+        self.crawler.stats.inc_value("checkpoints/resumed", spider=self)
+        yield from self.follow(checkpoint["query"], checkpoint["hits"], checkpoint["requests"])
+
+    def follow(self, query: str, hits, requests):
+        yield from self.parse_hits(hits, query)
+        for request in requests:
+            yield self.make_request(**request)
+
+    def error(self, failure):
+        # Only requests out of retries get here. They are not checkpointed, so resuming the crawl requests them again
+        self.failed += 1
+        self.crawler.stats.inc_value("juris/failed_requests", spider=self)
+        self.logger.error("Gave up on %s: %s", failure.request.url, failure.value)
+
+    def get_hits(self, res: Response):
+        document = jsonstream.decoded(res, self.stream_min_bytes)
+        if document is None:
+            hits = list(jsonstream.iter_items(res.body, HITS, self.hit_fields))
+        else:
+            hits = get_path(document, HITS) or []
+        self.metrics["hits"].observe(len(hits))
+        return hits
+
+    @measured
+    def parse(self, res, query: str = ""):
+        yield from self.complete(res, query or self.query, self.get_hits(res), [])
+
+    def parse_hits(self, hits, query: str):
         for hit in hits:
-            item = hit.get("_source", {}).get("documental_doutrina_texto")
-            if item:
-                entries = [entry.strip() for entry in double_nl.split(item)]
-                yield {"lines": entries}
+            if self.batch:
+                # Documents matched by several queries are only parsed once
+                document = self.documents.get(hit["_id"])
+                if document is not None:
+                    if query not in document["queries"]:
+                        document["queries"].append(query)
+                    continue
+            # Ties and concurrent index updates can move a document between pages
+            elif hit["_id"] in self.seen:
+                continue
+            self.seen.add(hit["_id"])
+
+            item = {}
+            for name, extractor in self.extractors.items():
+                value = get_path(hit, extractor.path)
+                if value:
+                    item[name] = extractor.parse(value)
+            if self.incremental:
+                self.save_result(item)
+            if self.batch:
+                self.documents[hit["_id"]] = {**item, "queries": [query]}
+            elif self.wanted(item):
+                yield item
+
+    def spider_idle(self):
+        # Documents of a batch are only complete once every query is done
+        if self.emitted:
+            return
+        self.emitted = True
+        request = Request("data:,", callback=self.emit_documents, dont_filter=True)
+        try:
+            self.crawler.engine.crawl(request)
+        except TypeError:
+            # Scrapy < 2.6 also needs the spider
+            self.crawler.engine.crawl(request, self)
+        raise DontCloseSpider
+
+    def emit_documents(self, res):
+        for document in self.documents.values():
+            if self.wanted(document):
+                yield document
+
+    def wanted(self, item: dict) -> bool:
+        """Whether an item has any of the fields asked for, besides the _id and julgamento_data always extracted"""
+        return not self.fields or not self.fields.isdisjoint(item)
+
+    def replay(self):
+        """Results of previous runs, seen before any hit is parsed.
+
+        Interrupted runs save results past the mark, which are crawled again from it.
+        """
+        for item in self.state.iter_results(self.state_key):
+            self.seen.add(item["_id"])
+            self.move_mark(item)
+            # Stores of older runs also hold decisions without any field asked for
+            if self.wanted(item):
+                yield item
+
+    def save_result(self, item: dict):
+        # Every decision moves the mark, but only those output are replayed
+        if self.wanted(item):
+            self.state.save_result(self.state_key, item["_id"], item)
+        self.move_mark(item)
+
+    def move_mark(self, item: dict):
+        if "julgamento_data" not in item:
+            return
+
+        judged = date.fromisoformat(item["julgamento_data"])
+        if self.mark is None or judged > self.mark[0]:
+            self.mark = judged, {item["_id"]}
+        elif judged == self.mark[0]:
+            self.mark[1].add(item["_id"])
+
+    def closed(self, reason: str):
+        for name, histogram in self.metrics.items():
+            for key, value in histogram.stats(f"juris/metrics/{name}").items():
+                self.crawler.stats.set_value(key, value, spider=self)
+        if self.state is None:
+            return
+        complete = reason == "finished" and not self.failed
+        # An interrupted crawl may have missed older decisions, keep the previous mark then
+        if complete and self.incremental and self.mark:
+            self.state.set_mark(self.state_key, self.mark[0], sorted(self.mark[1]))
+        # Checkpoints are only kept for resuming incomplete crawls
+        if complete and self.checkpoints:
+            self.state.clear_checkpoints(self.run_key)
+        self.state.close()
@@ -0,0 +1,89 @@
+import json
+import os
+import sqlite3
+import time
+import zlib
+from datetime import date
+from typing import Iterator, List, Optional, Set, Tuple
+
+from scrapy.utils.project import data_path
+
+
+class StateStore:
+    """State kept between runs of the same query, in a SQLite database under STF_STATE_DIR"""
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS marks (
+                query TEXT PRIMARY KEY,
+                date TEXT NOT NULL,
+                ids TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                query TEXT NOT NULL,
+                id TEXT NOT NULL,
+                item TEXT NOT NULL,
+                PRIMARY KEY (query, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                run TEXT NOT NULL,
+                url TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (run, url)
+            ) WITHOUT ROWID;
+            PRAGMA synchronous = NORMAL;
+            """
+        )
+
+    @classmethod
+    def from_settings(cls, settings, name: str):
+        return cls(os.path.join(data_path(settings["STF_STATE_DIR"], createdir=True), f"{name}.sqlite3"))
+
+    def get_mark(self, query: str) -> Optional[Tuple[date, List[str]]]:
+        """Newest julgamento_data seen for the query and the documents judged on that date"""
+        row = self.db.execute("SELECT date, ids FROM marks WHERE query = ?", (query,)).fetchone()
+        if row is None:
+            return None
+        return date.fromisoformat(row[0]), json.loads(row[1])
+
+    def set_mark(self, query: str, mark: date, ids: List[str]):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO marks VALUES (?, ?, ?)", (query, mark.isoformat(), json.dumps(ids)))
+
+    def iter_results(self, query: str) -> Iterator[dict]:
+        # Fetched at once, results saved while these are consumed must not show up again
+        for (item,) in self.db.execute("SELECT item FROM results WHERE query = ?", (query,)).fetchall():
+            yield json.loads(item)
+
+    def save_result(self, query: str, id: str, item: dict):
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (query, id, json.dumps(item)))
+
+    def checkpointed(self, run: str, max_age: int) -> Set[str]:
+        """URLs of the pages completed by a previous run, checkpoints older than `max_age` seconds are dropped"""
+        with self.db:
+            self.db.execute("DELETE FROM checkpoints WHERE created < ?", (time.time() - max_age,))
+        return {url for (url,) in self.db.execute("SELECT url FROM checkpoints WHERE run = ?", (run,))}
+
+    def get_checkpoint(self, run: str, url: str) -> dict:
+        row = self.db.execute("SELECT data FROM checkpoints WHERE run = ? AND url = ?", (run, url)).fetchone()
+        return json.loads(zlib.decompress(row[0]))
+
+    def save_checkpoint(self, run: str, url: str, data: dict):
+        # Committed right away, they must survive the crawl being killed
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (run, url, zlib.compress(json.dumps(data).encode()), time.time()),
+            )
+
+    def clear_checkpoints(self, run: str):
+        with self.db:
+            self.db.execute("DELETE FROM checkpoints WHERE run = ?", (run,))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
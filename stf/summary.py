@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Tuple
+
+
+class SummaryCache:
+    """Value of `fetch` shared by every request for `ttl` seconds.
+
+    Only one thread fetches it at a time, the others wait for its result instead of
+    fetching it again. Watchers are woken up whenever a fetch changes the value.
+    """
+
+    def __init__(self, fetch: Callable[[], Any], ttl: float):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.value = None
+        self.version = 0
+        self.expires = 0.0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()
+
+    def get(self) -> Any:
+        if time.monotonic() < self.expires:
+            return self.value
+        with self.lock:
+            # Fetched by another thread while this one waited
+            if time.monotonic() < self.expires:
+                return self.value
+            value = self.fetch()
+            with self.changed:
+                if value != self.value or not self.version:
+                    self.value = value
+                    self.version += 1
+                    self.changed.notify_all()
+            self.expires = time.monotonic() + self.ttl
+        return self.value
+
+    def invalidate(self):
+        # Watchers fetch it again right away
+        with self.changed:
+            self.expires = 0.0
+            self.changed.notify_all()
+
+    def watch(self, duration: float) -> Iterator[Any]:
+        """Yields the value whenever it changes, or None to keep the connection alive, for `duration` seconds"""
+        deadline = time.monotonic() + duration
+        version = None
+        while time.monotonic() < deadline:
+            value = self.get()
+            if version != self.version:
+                version = self.version
+                yield value
+            else:
+                yield None
+            with self.changed:
+                if version == self.version:
+                    self.changed.wait(max(self.expires - time.monotonic(), 0) + 0.1)
+
+
+class TokenCache:
+    """Values of `fetch(token)` shared for `ttl` seconds by the requests holding the same token.
+
+    Tokens are handed out by a shared value, so clients hold the same few of them and
+    only the latest `size` are kept. Like SummaryCache, one thread fetches at a time.
+    """
+
+    def __init__(self, fetch: Callable[[Any], Any], ttl: float, size: int = 64):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.size = size
+        self.values: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token: Any) -> Any:
+        with self.lock:
+            cached = self.values.get(token)
+            if cached and time.monotonic() < cached[0]:
+                return cached[1]
+            value = self.fetch(token)
+            self.values[token] = (time.monotonic() + self.ttl, value)
+            self.values.move_to_end(token)
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.values.clear()
@@ -1,14 +1,77 @@
+import gzip
+import json
 import os
+import secrets
+import tempfile
+import threading
+import time
+from datetime import date
 from functools import reduce
+from itertools import islice
 from typing import Dict, List
 
 import flask
-from scrapinghub import DuplicateJobError, ScrapinghubClient
+from werkzeug.wsgi import FileWrapper
+
+from stf import groups, jobs, metrics, reuse
+from stf.exportcache import ExportCache
+from stf.exports import FORMATS, export
+from stf.index import ReferenceIndex
+from stf.preview import Preview
+from stf.spiders.juris import EARLIEST_DATE, MAX_RESULT, JurisSpider
+from stf.summary import SummaryCache, TokenCache
+
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "scrapinghub")
+REQUEST_SECONDS = metrics.Family(
+    "stf_http_request_duration_seconds",
+    "Time spent serving requests, until streamed responses are sent",
+    ("method", "endpoint", "status"),
+)
+BACKEND_SECONDS = metrics.Family(
+    "stf_backend_call_duration_seconds", "Time spent in calls to the job backend", ("backend", "call")
+)
 
 application = flask.Flask(__name__)
-hub = ScrapinghubClient()
-project = hub.get_project(int(os.environ["SH_PROJECT"]))
-spider = project.spiders.get("juris")
+backend = metrics.Instrumented(
+    jobs.from_env(),
+    BACKEND_SECONDS,
+    ("run", "active", "page", "changed", "finished", "group", "state", "items", "packed_path"),
+    JOB_BACKEND,
+)
+exports = ExportCache(
+    os.environ.get("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), f"stf-exports-{JOB_BACKEND}")),
+    int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 1024 * 1024 * 1024)),
+)
+# Jobs listed per state in a page, JOBS_PAGE_SIZE unless asked for up to JOBS_MAX_PAGE_SIZE
+JOBS_PAGE_SIZE = int(os.environ.get("JOBS_PAGE_SIZE", 10))
+JOBS_MAX_PAGE_SIZE = int(os.environ.get("JOBS_MAX_PAGE_SIZE", 100))
+# Clients that missed more changes than this reload the first page instead
+JOBS_MAX_CHANGES = int(os.environ.get("JOBS_MAX_CHANGES", 200))
+# Jobs changed up to that many milliseconds before the latest change are sent again, in case one was recorded late
+CHANGES_MARGIN = 1000
+# However many clients are watching, the backend is asked for the first page of jobs, and for the changes
+# since every token handed out, once per JOBS_CACHE_TTL or whenever the first page changed
+summary = SummaryCache(lambda: first_page(), float(os.environ.get("JOBS_CACHE_TTL", 10)))
+changes = TokenCache(lambda key: changed_since(key[0]), summary.ttl)
+# References of finished jobs, indexed every INDEX_INTERVAL seconds
+reference_index = ReferenceIndex(
+    os.environ.get("INDEX_PATH", os.path.join(tempfile.gettempdir(), f"stf-index-{JOB_BACKEND}.sqlite3"))
+)
+reference_index.watch(backend, float(os.environ.get("INDEX_INTERVAL", 60)), application.logger)
+# Previews are cached per query for PREVIEW_CACHE_TTL seconds, durations assume PREVIEW_PAGES_PER_SECOND
+preview = Preview(
+    os.environ.get("STF_API_URL", JurisSpider.base_url),
+    float(os.environ.get("PREVIEW_CACHE_TTL", 300)),
+    float(os.environ.get("PREVIEW_PAGES_PER_SECOND", 2)),
+)
+# Queries with at least FANOUT_MIN_HITS hits are crawled by FANOUT_JOBS jobs in parallel
+FANOUT_JOBS = int(os.environ.get("FANOUT_JOBS", 4))
+FANOUT_MIN_HITS = int(os.environ.get("FANOUT_MIN_HITS", MAX_RESULT))
+# Event streams hold a worker thread, clients reconnect after this many seconds. At most EVENTS_MAX_STREAMS
+# are open at once per process, to leave threads for the other requests, clients over it poll instead
+EVENTS_MAX_AGE = float(os.environ.get("EVENTS_MAX_AGE", 300))
+EVENTS_MAX_STREAMS = int(os.environ.get("EVENTS_MAX_STREAMS", 16))
+event_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
 
 
 def group_by_state(value: Dict[str, List], job):
@@ -16,14 +79,105 @@ def group_by_state(value: Dict[str, List], job):
     return {**value, state: [*value.get(state, []), job]}
 
 
+@application.before_request
+def start_timer():
+    flask.g.started = time.perf_counter()
+
+
+@application.after_request
+def observe_request(res):
+    histogram = REQUEST_SECONDS.labels(flask.request.method, flask.request.endpoint, res.status_code)
+    started = flask.g.started
+    # Streamed responses are done once closed by the server
+    res.call_on_close(lambda: histogram.observe(time.perf_counter() - started))
+    return res
+
+
+@application.route("/metrics", methods=["GET"])
+def show_metrics():
+    return flask.Response(
+        metrics.render(REQUEST_SECONDS, BACKEND_SECONDS), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @application.route("/", methods=["GET"])
 def index():
     return flask.render_template("index.html")
 
 
+def since_token(changed: List[dict], since: int = 0) -> int:
+    return max([since, *(job["ts"] - CHANGES_MARGIN for job in changed)])
+
+
+def first_page() -> dict:
+    """Latest jobs of every state, with the cursors of their next pages and the token of their changes"""
+    page, cursors = [], {}
+    for state in jobs.STATES:
+        state_page, cursors[state] = backend.page(state, None, JOBS_PAGE_SIZE)
+        page += state_page
+    return {"jobs": groups.collapse(page, backend.group), "cursors": cursors, "since": since_token(page)}
+
+
+def changed_since(since: int) -> dict:
+    changed = list(islice(backend.changed(since), JOBS_MAX_CHANGES + 1))
+    if len(changed) > JOBS_MAX_CHANGES:
+        return {"reset": True}
+    return {"jobs": groups.collapse(changed, backend.group), "since": since_token(changed, since)}
+
+
 @application.route("/jobs/", methods=["GET"])
 def list_jobs():
-    return {group["name"]: group["summary"] for group in spider.jobs.summary()}
+    """First page of jobs, a page of a state with `state`, `cursor` and `limit`, or the jobs changed `since` a token
+
+    Jobs are upserted by key by clients, their state telling where they belong.
+    """
+    args = flask.request.args
+    if "since" in args:
+        since = args.get("since", type=int)
+        if since is None:
+            return "Token inválido.", 400
+        return changes.get((since, summary.version))
+
+    state = args.get("state")
+    if state is None:
+        return summary.get()
+    if state not in jobs.STATES:
+        return "Estado inválido.", 400
+    limit = min(max(args.get("limit", JOBS_PAGE_SIZE, type=int), 1), JOBS_MAX_PAGE_SIZE)
+    try:
+        page, cursor = backend.page(state, args.get("cursor") or None, limit)
+    except ValueError:
+        return "Cursor inválido.", 400
+    return {"jobs": groups.collapse(page, backend.group), "cursors": {state: cursor}}
+
+
+@application.route("/jobs/events", methods=["GET"])
+def job_events():
+    # Reconnecting clients send the id of the last event they got
+    since = flask.request.args.get("since", type=int) or flask.request.headers.get("Last-Event-ID", type=int)
+    # No content tells EventSource not to reconnect
+    if not event_streams.acquire(blocking=False):
+        return "", 204
+
+    def events(since):
+        yield "retry: 5000\n\n"
+        for page in summary.watch(EVENTS_MAX_AGE):
+            if page is None:
+                yield ":\n\n"
+                continue
+            # Whenever the first page changes, the jobs changed since the client's token are pushed
+            data = page if since is None else changes.get((since, summary.version))
+            if data.get("reset"):
+                data = page
+            elif data is not page and not data["jobs"]:
+                continue
+            since = data["since"]
+            yield f"id: {since}\ndata: {json.dumps(data)}\n\n"
+
+    response = flask.Response(events(since), content_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    # Called by the server once the stream ends, even when the client went away before it started
+    response.call_on_close(event_streams.release)
+    return response
 
 
 @application.route("/jobs/", methods=["POST"])
@@ -35,26 +189,194 @@ def create_job():
     date_from = flask.request.form["date_from"]
     date_to = flask.request.form["date_to"]
 
-    try:
-        job = spider.jobs.run(
-            job_args={"date_from": date_from, "date_to": date_to, "query": query},
-            meta={"key": f"{query}/{date_from}-{date_to}"},
-        )
-        return {"key": job.key}, 201
-    except DuplicateJobError:
+    # Answered by a finished job without crawling again
+    found = reused(query, date_from, date_to)
+    if found:
+        return found, 200
+
+    ranges = fanout(query, date_from, date_to)
+    if not ranges:
+        args = {"date_from": date_from, "date_to": date_to, "query": query}
+        try:
+            key = backend.run(args, jobs.job_key(args))
+        except jobs.DuplicateJob:
+            return "", 425
+        summary.invalidate()
+        changes.invalidate()
+        return {"key": key}, 201
+
+    token = secrets.token_hex(6)
+    children = [
+        {"date_from": start.isoformat(), "date_to": end.isoformat(), "query": query, "group": token}
+        for start, end in ranges
+    ]
+    # Checked before scheduling any child, so that none is left running outside of a group the client knows of
+    if backend.active(map(jobs.job_key, children)):
         return "", 425
+    scheduled = []
+    for args in children:
+        try:
+            scheduled.append(backend.run(args, jobs.job_key(args)))
+        except jobs.DuplicateJob:
+            # Scheduled in between by another request, the children already scheduled still make up the group
+            if not scheduled:
+                return "", 425
+            application.logger.warning("Group %s lacks %s, scheduled meanwhile", token, jobs.job_key(args))
+    summary.invalidate()
+    changes.invalidate()
+    return {"key": groups.key(token), "jobs": scheduled}, 201
+
+
+def reused(query: str, date_from: str, date_to: str):
+    """Key of a finished job or group covering a request, with the days to narrow its exports to"""
+    try:
+        first, last = reuse.days(date_from, date_to)
+    except ValueError:
+        return None
+    for job in reference_index.covering(query, first, last):
+        if "group" in job:
+            # Every child must have finished and been indexed
+            children = backend.group(job["group"])
+            if len(children) != job["jobs"] or not all(map(reuse.complete, children)):
+                continue
+            key = groups.key(job["group"])
+        else:
+            key = job["key"]
+        return {"key": key, "date_from": first, "date_to": last}
+    return None
+
+
+def fanout(query: str, date_from: str, date_to: str):
+    """Ranges of the children of a query worth splitting, None to crawl it in a single job"""
+    if FANOUT_JOBS < 2:
+        return None
+    try:
+        start = date.fromisoformat(date_from) if date_from else EARLIEST_DATE
+        end = date.fromisoformat(date_to) if date_to else date.today()
+        result = preview.get(query, date_from, date_to)
+    except (OSError, ValueError, KeyError) as e:
+        application.logger.warning("Not splitting %r, its preview failed: %s", query, e)
+        return None
+    if start >= end or result["total"] < FANOUT_MIN_HITS:
+        return None
+    ranges = groups.split(result["years"], start, end, FANOUT_JOBS)
+    return ranges if len(ranges) > 1 else None
+
+
+@application.route("/preview", methods=["GET"])
+def preview_job():
+    query = flask.request.args.get("query", "")
+    if not query:
+        return "É necessário informar uma busca!", 400
+
+    date_from = flask.request.args.get("date_from", "")
+    date_to = flask.request.args.get("date_to", "")
+    try:
+        reuse.days(date_from, date_to)
+    except ValueError:
+        return "Data inválida.", 400
+
+    try:
+        return preview.get(query, date_from, date_to)
+    except (OSError, ValueError, KeyError) as e:
+        application.logger.warning("Preview of %r failed: %s", query, e)
+        return "Não foi possível consultar o STF.", 502
+
+
+@application.route("/search", methods=["GET"])
+def search():
+    query = flask.request.args.get("q", "")
+    if not query.strip():
+        return "É necessário informar uma busca!", 400
+
+    kind = flask.request.args.get("kind") or None
+    limit = min(max(flask.request.args.get("limit", 50, type=int), 1), 500)
+    return {"results": reference_index.search(query, kind, limit)}
 
 
 @application.route("/jobs/<int:job_id>.<ext>", methods=["GET"])
 def show_job(job_id: int, ext):
-    key = f"{spider.key}/{job_id}"
-    print(key)
-    job = spider.jobs.get(key)
-    lines = (i["lines"] for i in job.items.iter())
-    if ext == "json":
-        return {"items": [*lines]}
-    if ext == "txt":
-        return "\n\n".join(["\n\n".join(line) for line in lines]), {"Content-Type": "text/plain; charset=utf-8"}
+    if ext not in FORMATS:
+        flask.abort(404)
+
+    days = export_days()
+    if ext == "packed" and days is None:
+        # Local jobs are stored packed, finished ones are sent as they are
+        path = backend.packed_path(job_id)
+        if path:
+            return flask.send_file(path, mimetype=FORMATS[ext], download_name=f"{job_id}.{ext}", conditional=True)
+
+    name = str(job_id) if days is None else f"{job_id}_{days[0]}_{days[1]}"
+    # Only finished jobs are cached, so cached exports are served without asking the backend
+    cached = exports.get(name, ext)
+    if cached is None:
+        # Items are sent as they are fetched, the job is never held in memory
+        items = backend.items(job_id)
+        if days:
+            items = reuse.within(items, *days)
+        chunks = export(items, ext)
+        if backend.state(job_id) == "finished":
+            chunks = exports.write(name, ext, chunks)
+        return flask.Response(chunks, content_type=FORMATS[ext])
+    return send_cached(name, ext, *cached)
+
+
+@application.route("/groups/<token>.<ext>", methods=["GET"])
+def show_group(token: str, ext):
+    if ext not in FORMATS:
+        flask.abort(404)
+
+    days = export_days()
+    name = f"group-{token}" if days is None else f"group-{token}_{days[0]}_{days[1]}"
+    cached = exports.get(name, ext)
+    if cached is None:
+        children = groups.ordered(backend.group(token))
+        if not children:
+            flask.abort(404)
+        finished = all(child["state"] == "finished" for child in children)
+        if days:
+            # Children out of the range are not read at all
+            children = [
+                child
+                for child in children
+                if child["spider_args"]["date_from"] <= days[1] and child["spider_args"]["date_to"] >= days[0]
+            ]
+        streams = (backend.items(int(child["key"].rsplit("/", 1)[1])) for child in children)
+        if days:
+            streams = (reuse.within(items, *days) for items in streams)
+        chunks = export(groups.merge(streams), ext)
+        if finished:
+            chunks = exports.write(name, ext, chunks)
+        return flask.Response(chunks, content_type=FORMATS[ext])
+    return send_cached(name, ext, *cached)
+
+
+def export_days():
+    """Days an export is narrowed to by its date_from and date_to arguments, None for all of them"""
+    date_from = flask.request.args.get("date_from", "")
+    date_to = flask.request.args.get("date_to", "")
+    if not date_from and not date_to:
+        return None
+    try:
+        return reuse.days(date_from, date_to)
+    except ValueError:
+        flask.abort(400)
+
+
+def send_cached(name, ext, path, etag, length):
+    if flask.request.accept_encodings["gzip"]:
+        res = flask.send_file(path, download_name=f"{name}.{ext}", etag=f"{etag}-gzip")
+        res.headers["Content-Encoding"] = "gzip"
+    else:
+        # Seeking decompresses up to the start of the range
+        res = flask.Response(FileWrapper(gzip.open(path, "rb"), 64 * 1024))
+        res.content_length = length
+        res.set_etag(etag)
+        res.make_conditional(flask.request, accept_ranges=True, complete_length=length)
+    # Set after send_file, which would add a charset of its own to text types
+    res.content_type = FORMATS[ext]
+    res.vary.add("Accept-Encoding")
+    return res
 
 
 if __name__ == "__main__":